@@ -0,0 +1,90 @@
+import glob, os, re, sqlite3 # Standard
+import db_pool # Internal
+
+#
+# Season archives
+#
+# Closed seasons are moved out of the live database into one file per year,
+# archive/erdling_<year>.db next to erdling.db (see db_stuff.rollover_season).
+# The live database keeps the current season and every open record, so the
+# daily pages (harvest, Folien, active beds) never read the archives. The
+# history views query {Plantings} and {SoilImprovements} instead of the plain
+# tables: with archives, these are UNION ALL subqueries over the live table and
+# the ATTACHed archive files.
+#
+ARCHIVE_DIR = 'archive'
+# Tables with rows per season, by their ID column.
+ARCHIVED_TABLES = {
+    'Plantings': 'PlantingID',
+    'SoilImprovements': 'ImprovementID',
+}
+# Databases SQLite can ATTACH to one connection, more archives are queried in batches.
+MAX_ATTACHED = sqlite3.connect(':memory:').getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+
+def archive_path(database, year):
+    stem = os.path.splitext(os.path.basename(database))[0]
+    return os.path.join(os.path.dirname(database), ARCHIVE_DIR, f'{stem}_{year}.db')
+
+def archive_paths(database):
+    # Archive files of the database, most recent season first.
+    pattern = archive_path(database, '[0-9][0-9][0-9][0-9]')
+    return sorted(glob.glob(pattern), reverse=True)
+
+def archive_year(path):
+    return re.search(r'_(\d{4})\.db$', path).group(1)
+
+def schema_name(path):
+    return f'archive_{archive_year(path)}'
+
+def history_batches(database):
+    # (archive files, table SQL) per query. The first batch reads the live
+    # tables as well, the others only their archives.
+    paths = archive_paths(database)
+    if len(paths) == 0:
+        return [((), {table: table for table in ARCHIVED_TABLES})]
+    batches = []
+    for i in range(0, len(paths), MAX_ATTACHED):
+        batch = tuple(paths[i:i + MAX_ATTACHED])
+        schemas = (['main'] if i == 0 else []) + [schema_name(path) for path in batch]
+        tables = {}
+        for table in ARCHIVED_TABLES:
+            union = ' UNION ALL '.join(f'SELECT * FROM {schema}.{table}' for schema in schemas)
+            tables[table] = f'({union}) AS {table}'
+        batches.append((batch, tables))
+    return batches
+
+def attach(conn, paths):
+    # Attach the archive files missing on this (pooled) connection. Others stay
+    # attached for the next history query unless there is no room left.
+    if len(paths) == 0:
+        return
+    attached = {row[1] for row in conn.execute('PRAGMA database_list')} - {'main', 'temp'}
+    missing = [path for path in paths if schema_name(path) not in attached]
+    if len(missing) == 0:
+        return
+    wanted = {schema_name(path) for path in paths}
+    if len(attached) + len(missing) > MAX_ATTACHED:
+        for schema in attached - wanted:
+            conn.execute(f'DETACH DATABASE {schema}')
+    for path in missing:
+        uri = db_pool.database_uri(path)
+        conn.execute(f'ATTACH DATABASE ? AS {schema_name(path)}', (uri,))
+
+def archived_crop_ids(database):
+    # Crops planted in the archived seasons, for the crop search index.
+    ids = set()
+    for path in archive_paths(database):
+        with db_pool.pooled_connection(path) as conn:
+            ids.update(row[0] for row in conn.execute('SELECT DISTINCT CropID FROM Plantings WHERE CropID IS NOT NULL'))
+    return ids
+
+def archived_ids(database, table):
+    # IDs of the rows of a sheet that were moved to an archive, so ingest and
+    # sync don't put them back into the live database.
+    ids = set()
+    if table not in ARCHIVED_TABLES:
+        return ids
+    for path in archive_paths(database):
+        with db_pool.pooled_connection(path) as conn:
+            ids.update(row[0] for row in conn.execute(f'SELECT {ARCHIVED_TABLES[table]} FROM {table}'))
+    return ids
@@ -0,0 +1,221 @@
+import argparse, json, os, platform, shutil, sys, time, tracemalloc # Standard
+from datetime import datetime
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import farmapp, http_cache, synthetic_db # Internal
+
+#
+# Benchmarks
+#
+# Times and memory-profiles the query and harvest pipeline, the figure builders
+# and the routes on the bundled database and on synthetic ones scaled up with
+# synthetic_db.py. Save a baseline before a change and compare against it:
+#
+#   python benchmarks.py --scales 1 10 100 --out bench_baseline.json
+#   python benchmarks.py --scales 1 10 100 --compare bench_baseline.json
+#
+BENCH_DATA_DIR = 'bench_data'
+REGRESSION_THRESHOLD = 1.5 # Slower than baseline times this is a regression
+ROUTES = ['/', '/ernteliste', '/erntekalender', '/anbau', '/folien', '/beetID/5', '/api/harvest', '/api/suggest?q=ka']
+
+def time_call(func, repeat=5, setup=None):
+    # Best of repeat runs in seconds, and the result of the last run.
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def peak_memory(func, setup=None):
+    # Peak of the memory allocated while func runs, in MiB.
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    func()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+def clear_caches():
+    farmapp.data_cache.clear()
+    farmapp.get_anbau_figure_json.cache_clear()
+    http_cache.clear_cache()
+    shutil.rmtree(farmapp.FIGURE_CACHE_DIR, ignore_errors=True)
+
+#
+# Anbau figures: single-pass trace builder vs. one px.timeline per window.
+#
+def make_anbau_figure_px(df, height, grouped=True, bar_widths=False):
+    # Reference implementation the figures were built with before make_anbau_traces.
+    figs = []
+    for start, end, marker_clr, bar_width in farmapp.ANBAU_WINDOWS:
+        fig = px.timeline(
+            df,
+            x_start=start,
+            x_end=end,
+            y="CropName",
+            labels={
+                "CropName": "Kulturnamen"
+            }
+        )
+        fig.update_traces(marker_color=marker_clr)
+        if bar_widths:
+            for d in fig.data:
+                d.width = bar_width
+        figs.append(fig)
+    data = tuple()
+    for fig in figs:
+        data += fig.data
+    combined_figure = go.Figure(data=data, layout=figs[0].layout)
+    combined_figure.update_layout({
+        'plot_bgcolor': 'rgb(234,216,192)',
+        'paper_bgcolor': 'rgba(0, 0, 0, 0)',
+        'height': height
+        })
+    combined_figure.update_xaxes(range=['2026-01-01', '2026-12-31'], fixedrange=True)
+    combined_figure.update_yaxes(autorange="reversed", fixedrange=True)
+    if grouped:
+        combined_figure.update_layout({'barmode':'group'})
+    return combined_figure
+
+def same_figure(fig_a, fig_b):
+    # Compare the serialized figures, NaN values included.
+    json_a = json.loads(fig_a.to_json())
+    json_b = json.loads(fig_b.to_json())
+    return json_a == json_b
+
+def bench_anbau_figures(repeat=5):
+    anbau_cols, anbau_data = farmapp.get_all_anbau_info()
+    df_anbau = pd.DataFrame(anbau_data, columns=anbau_cols)
+    df_anbau = df_anbau.where(df_anbau.notnull(), '')
+    df_crop = df_anbau.iloc[[0]].reset_index(drop=True)
+    cases = [
+        ('anbau overview', lambda: make_anbau_figure_px(df_anbau, 3000, grouped=False, bar_widths=True),
+            lambda: farmapp.make_anbau_figure_overview(df_anbau, 3000, grouped=False)),
+        ('anbau per crop', lambda: make_anbau_figure_px(df_crop, 400),
+            lambda: farmapp.make_anbau_figure(df_crop, 400)),
+    ]
+    results = {}
+    for name, px_path, trace_path in cases:
+        px_time, px_fig = time_call(px_path, repeat)
+        trace_time, trace_fig = time_call(trace_path, repeat)
+        results[name] = {
+            'px_timeline_s': px_time,
+            'trace_builder_s': trace_time,
+            'speedup': px_time / trace_time,
+            'same_figure': same_figure(px_fig, trace_fig),
+        }
+        print('{}: px.timeline {:.1f} ms, trace builder {:.1f} ms ({:.1f}x), same figure: {}'.format(
+            name, px_time * 1000, trace_time * 1000, px_time / trace_time, results[name]['same_figure']))
+    return results
+
+#
+# Scaling suite
+#
+def bench_database(scale):
+    # The bundled database for scale 1, otherwise a generated one.
+    if scale == 1:
+        return farmapp.DATABASE
+    path = os.path.join(BENCH_DATA_DIR, f'erdling_x{scale}.db')
+    if not os.path.exists(path):
+        os.makedirs(BENCH_DATA_DIR, exist_ok=True)
+        print(f'Generating {path}...')
+        synthetic_db.generate_database(path, scale)
+    return path
+
+def anbau_frame(anbau_cols, anbau_data):
+    df_anbau = pd.DataFrame(anbau_data, columns=anbau_cols)
+    return df_anbau.where(df_anbau.notnull(), '')
+
+def pipeline_cases():
+    # (name, func, setup) for every measured step.
+    client = farmapp.app.test_client()
+    families = list(farmapp.crop_family_colors.keys())
+    # A planted crop with Anbau infos, the crop page needs both.
+    kultur_name = next(name for name in farmapp.get_all_planted_crops() if len(farmapp.get_anbau_info(name)[1]) != 0)
+    def get_route(path):
+        def request_route():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f'{path}: {response.status_code}')
+        return request_route
+    cases = [
+        ('generate_harvest_table', farmapp.generate_harvest_table, None),
+        ('get_family_anbau_overview', lambda: farmapp.get_family_anbau_overview(families), None),
+        ('get_most_recent_update_date', farmapp.get_most_recent_update_date, clear_caches),
+        ('make_anbau_figure_overview', lambda: farmapp.make_anbau_figure_overview(anbau_frame(*farmapp.get_all_anbau_info()), 3000, grouped=False), None),
+        ('make_anbau_figure', lambda: farmapp.make_anbau_figure(anbau_frame(*farmapp.get_anbau_info(kultur_name)), 400), None),
+    ]
+    for path in ROUTES + [f'/kulturname/{kultur_name}']:
+        cases.append((f'GET {path} (cold)', get_route(path), clear_caches))
+        cases.append((f'GET {path} (warm)', get_route(path), None))
+    return cases
+
+def bench_scale(scale, repeat=3):
+    database = farmapp.DATABASE
+    farmapp.DATABASE = bench_database(scale)
+    results = {}
+    try:
+        for name, func, setup in pipeline_cases():
+            # Warm caches for the warm cases, imports and the page cache for all.
+            func()
+            seconds, _result = time_call(func, repeat, setup)
+            results[name] = {
+                'time_s': seconds,
+                'peak_mib': peak_memory(func, setup),
+            }
+            print('x{} {}: {:.1f} ms, {:.1f} MiB'.format(scale, name, seconds * 1000, results[name]['peak_mib']))
+    finally:
+        farmapp.DATABASE = database
+        clear_caches()
+    return results
+
+def run_suite(scales, repeat=3):
+    return {
+        'meta': {
+            'date': datetime.today().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pandas': pd.__version__,
+        },
+        'results': {f'x{scale}': bench_scale(scale, repeat) for scale in scales},
+    }
+
+def compare_results(results, baseline, threshold=REGRESSION_THRESHOLD):
+    # Every step that got slower than the baseline by more than the threshold.
+    regressions = []
+    for scale, cases in results['results'].items():
+        for name, result in cases.items():
+            base = baseline['results'].get(scale, {}).get(name)
+            if base is None:
+                continue
+            if result['time_s'] > base['time_s'] * threshold:
+                regressions.append((scale, name, base['time_s'], result['time_s']))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the query, harvest and figure pipeline.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+        help='Database sizes relative to the bundled one, e.g. 1 10 100 1000.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per step, the best one counts.')
+    parser.add_argument('--out', help='Save the results as JSON, e.g. as a new baseline.')
+    parser.add_argument('--compare', help='Baseline JSON to check the results against.')
+    args = parser.parse_args()
+    bench_anbau_figures()
+    results = run_suite(args.scales, args.repeat)
+    if args.out:
+        with open(args.out, mode='w') as f:
+            json.dump(results, f, indent=2)
+        print('Results saved to: {}'.format(args.out))
+    if args.compare:
+        with open(args.compare, mode='r') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline)
+        for scale, name, base_time, new_time in regressions:
+            print('Regression {} {}: {:.1f} ms -> {:.1f} ms'.format(scale, name, base_time * 1000, new_time * 1000))
+        if len(regressions) != 0:
+            sys.exit(1)
@@ -6,6 +6,8 @@ DATABASE = './erdling.db' # SQLite Database relative location
 # Example: https://docs.google.com/spreadsheets/d/{spreadsheet_id}/export?format=csv
 #
 GOOGLESHEETID = secret_farmapp.GOOGLESHEETID
+# Where the sheets are exported from; point to a local server for testing.
+GOOGLESHEET_BASE_URL = 'https://docs.google.com/spreadsheets/d'
 #
 # The name and GID of each table as a dictionary.
 # The GID are usually 9-10 digit 
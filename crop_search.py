@@ -0,0 +1,66 @@
+import json, re # Standard
+
+#
+# Crop search
+#
+# Full text index (SQLite FTS5) over the names, alternative names and
+# varieties of the crops that were planted, live or in an archived season, plus
+# the crops that only have Anbau infos, i.e. the crops with a /kulturname page.
+# Written at ingest with the other derived tables and searched by /api/suggest
+# as you type on the landing page. Every word of the input is matched as a prefix, without
+# case and diacritics ('mohr' finds Karotten via Möhren), and the matches are
+# ranked by bm25 with the crop name counting most.
+#
+# The index has a row per crop and variety rather than per crop: bm25 ranks
+# long rows down, which would put the crops with many varieties last.
+#
+SEARCH_COLUMNS = ['CropName', 'AlternativeNamen', 'CropSorte']
+COLUMN_WEIGHTS = [10.0, 5.0, 1.0]
+# The parameter is a JSON list of the CropIDs planted in the archived seasons.
+INDEX_QUERY = '''WITH PlantedCrops AS (
+                        SELECT DISTINCT CropName, AlternativeNamen, CropSorte
+                        FROM Crops
+                        WHERE CropName IS NOT NULL
+                        AND (CropID IN (SELECT CropID FROM Plantings)
+                            OR CropID IN (SELECT value FROM json_each(?))))
+                    SELECT CropName, AlternativeNamen, CropSorte
+                    FROM PlantedCrops
+                UNION
+                    SELECT CropName, NULL, NULL
+                    FROM AnbauInfos
+                    WHERE CropName IS NOT NULL
+                    AND LOWER(CropName) NOT IN (SELECT LOWER(CropName) FROM PlantedCrops);'''
+# Best match per crop, with the matching varieties. bm25() only works in the
+# query on the FTS table itself, hence the materialized CTE.
+SEARCH_QUERY = f'''WITH Matches AS MATERIALIZED (
+                        SELECT CropName, AlternativeNamen, CropSorte, bm25(CropSearch, {', '.join(map(str, COLUMN_WEIGHTS))}) AS Score
+                        FROM CropSearch
+                        WHERE CropSearch MATCH ?)
+                    SELECT CropName, MAX(AlternativeNamen) AS AlternativeNamen, GROUP_CONCAT(DISTINCT CropSorte) AS CropSorte
+                    FROM Matches
+                    GROUP BY CropName
+                    ORDER BY MIN(Score) ASC, CropName ASC
+                    LIMIT ?;'''
+
+# Crops with their alternative names, for resolving a typed name.
+NAMES_QUERY = '''SELECT DISTINCT CropName, AlternativeNamen
+                    FROM CropSearch
+                    WHERE CropSearch MATCH ?;'''
+
+def write_index(db, archived_crop_ids=()):
+    # Rebuild the index from the Crops, Plantings and AnbauInfos tables.
+    db.execute('DELETE FROM CropSearch')
+    db.execute(f"INSERT INTO CropSearch ({', '.join(SEARCH_COLUMNS)}) {INDEX_QUERY}",
+        (json.dumps(sorted(archived_crop_ids)),))
+
+def alternative_names(text):
+    # 'Dicke Bohnen, Puffbohnen' -> ['Dicke Bohnen', 'Puffbohnen']
+    if not text:
+        return []
+    return [name.strip() for name in text.split(',') if name.strip() != '']
+
+def match_expression(text):
+    # 'rote be' -> '"rote"* "be"*', or '' if there is nothing to search for.
+    # Quoted, so the input is never read as FTS5 query syntax.
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words)
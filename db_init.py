@@ -1,13 +1,33 @@
-import os # Standard
+import argparse, os, sys # Standard
 import config_farmapp, db_stuff # Internal
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fill the SQLite database from the Google sheets.')
+    parser.add_argument('--sync', action='store_true',
+        help='Only apply the rows that changed and replace the database file atomically.')
+    parser.add_argument('--harvest', action='store_true',
+        help='Only recompute the harvest status for today, e.g. as a daily job.')
+    parser.add_argument('--rollover', metavar='YEAR', type=int,
+        help='Move the closed records of a past season to its archive file.')
+    args = parser.parse_args()
+    if args.harvest:
+        db_stuff.refresh_harvest_status()
+        sys.exit()
+    if args.rollover:
+        db_stuff.rollover_season(args.rollover)
+        sys.exit()
     # Get sheets from GoogleDrive as CSV files.
     # Check config_farmapp for more info.
     os.makedirs(config_farmapp.CSV_DIR, exist_ok = True)
-    db_stuff.getGoogleSheet(config_farmapp.GOOGLESHEETID, config_farmapp.CSV_DIR, config_farmapp.GOOGLESHEETDICT)
-    # Initialise the database based on the CSV files.
-    # Delete any existing database file first.
-    # The deletion is manual (for now) to avoid unintentional overwriting.
-    db_stuff.init_db()
-    db_stuff.insert_data(config_farmapp.CSV_DIR, config_farmapp.GOOGLESHEETDICT.keys())
\ No newline at end of file
+    changed_sheets = db_stuff.getGoogleSheet(config_farmapp.GOOGLESHEETID, config_farmapp.CSV_DIR, config_farmapp.GOOGLESHEETDICT)
+    if args.sync:
+        # Update the live database in place of a full rebuild.
+        if len(changed_sheets) == 0 and os.path.exists(config_farmapp.DATABASE):
+            print('No sheet changed, nothing to sync.')
+        else:
+            db_stuff.sync_data(config_farmapp.CSV_DIR, config_farmapp.GOOGLESHEETDICT.keys())
+    else:
+        # Initialise the database based on the CSV files.
+        # Delete any existing database file first.
+        # The deletion is manual (for now) to avoid unintentional overwriting.
+        db_stuff.insert_data(config_farmapp.CSV_DIR, config_farmapp.GOOGLESHEETDICT.keys())
@@ -0,0 +1,67 @@
+import contextlib, os, pathlib, sqlite3, threading
+
+#
+# SQLite connection pool
+#
+# Connections are kept open between requests, so the page cache, the memory map
+# and the prepared statements (sqlite3 caches them per connection by SQL text)
+# are reused instead of being rebuilt for every query.
+POOL_SIZE = 8 # Idle connections kept per database file
+CACHED_STATEMENTS = 256 # Prepared statements kept per connection
+MMAP_SIZE = 256 * 1024 * 1024 # Bytes of the database file memory mapped
+CACHE_SIZE = -16000 # Page cache per connection, negative values are KiB
+
+pool = {}
+pool_lock = threading.Lock()
+
+def database_uri(database):
+    # Read-only URI, also for ATTACH on the pooled connections.
+    return pathlib.Path(database).resolve().as_uri() + '?mode=ro'
+
+def connect(database, readonly=True):
+    if readonly:
+        uri = database_uri(database)
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        conn.execute('PRAGMA query_only = ON')
+    else:
+        conn = sqlite3.connect(database, cached_statements=CACHED_STATEMENTS)
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    conn.execute(f'PRAGMA cache_size = {CACHE_SIZE}')
+    return conn
+
+def file_identity(database):
+    # A replaced database file gets a new inode, which retires older connections.
+    stat = os.stat(database)
+    return (stat.st_dev, stat.st_ino)
+
+@contextlib.contextmanager
+def pooled_connection(database):
+    identity = file_identity(database)
+    conn = None
+    with pool_lock:
+        idle = pool.setdefault(database, [])
+        while idle:
+            conn_identity, idle_conn = idle.pop()
+            if conn_identity == identity:
+                conn = idle_conn
+                break
+            idle_conn.close()
+    if conn is None:
+        conn = connect(database)
+    try:
+        yield conn
+    finally:
+        with pool_lock:
+            idle = pool.setdefault(database, [])
+            if len(idle) < POOL_SIZE:
+                idle.append((identity, conn))
+                conn = None
+        if conn is not None:
+            conn.close()
+
+def close_all():
+    with pool_lock:
+        for idle in pool.values():
+            for _identity, conn in idle:
+                conn.close()
+        pool.clear()
@@ -1,91 +1,418 @@
-import os, requests, sqlite3, sys
+import json, os, requests, sys, time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
-import config_farmapp # Internal
+import archive, config_farmapp, crop_search, db_pool, harvest # Internal
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024 # Bytes written to disk at a time
+DOWNLOAD_TIMEOUT = 60 # Seconds to wait for the server
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 1 # Seconds, doubled with every retry
+SHEET_VALIDATORS_FILE = 'sheet_validators.json'
 
 #
 # Database stuff
 #
 # Initialise schema
-def init_db():
-    db = get_db()
+def init_db(database=None):
+    db = get_db(database=database)
     with open('schema.sql', mode='r') as f:
         db.cursor().executescript(f.read())
     db.commit()
     db.close()
 
-def get_db():
-    db = sqlite3.connect(config_farmapp.DATABASE)
+def get_db(readonly=False, database=None):
+    # Same connection setup as the app's pool; writers get their own connection.
+    if database is None:
+        database = config_farmapp.DATABASE
+    db = db_pool.connect(database, readonly=readonly)
     return db
 
-def insert_data(csv_dir, sheet_names):
+def insert_data(csv_dir, sheet_names, database=None):
+    # Loaded into a copy of the database, which then replaces it.
+    if database is None:
+        database = config_farmapp.DATABASE
+    tmp_database = f'{database}.ingest'
+    copy_database(database, tmp_database)
     # creating a connection to the database
-    db = get_db()
-    for sheetname in sheet_names:
-        # reading data from the CSV file
-        path_to_csv = os.path.join(csv_dir, f'{sheetname}.csv')
-        df = pd.read_csv(path_to_csv)
-        # data cleanup
-        df.columns = df.columns.str.strip()
-        # Get the column names from the DataFrame
-        columns = df.columns.tolist()
-        id_col = columns[0]
-        #
-        # Check ID column for errors
-        #
-        exit_check = False
-        id_list = df[id_col].values.tolist() # get as list
-        id_list = [x for x in id_list if x != 'NaN'] # filter NaN
-        try:
-            id_list = [int(i) for i in id_list] # convert to int
-        except ValueError:
-            print("There is an invalid ID number in col {} in sheet {}, likely NaN".format(id_col, sheetname))
-            exit_check = True
-        id_list.sort() # sort ascending
-        maybe_missing = missing_number(id_list)
-        if len(maybe_missing) != 0:
-            print('Sheet {} is missing an expected ID in col {}: {}'.format(sheetname, id_col, str(maybe_missing)))
-            exit_check = True
-        # A set to keep track of elements that have been seen
-        seen = set()
-        # A list to store duplicates found in the input list
-        duplicates = []
-        # Iterate over each element in the list
-        for i in id_list:
-            if i in seen:
-                duplicates.append(i)
-            else:
-                seen.add(i)
-        if len(duplicates) != 0:
-            print('Sheet {} has ID duplicates in col {}: {}'.format(sheetname, id_col, str(duplicates)))
-            exit_check = True
-        if exit_check == True:
-            sys.exit()
-        columns_str = ', '.join(columns)
-        placeholders = ', '.join(['?'] * len(columns))
-        # Load data file to SQLite as tmp table -- skip for now. Keep for reference.
-        # df.to_sql('tmp', db, if_exists='replace', index=False)
-        # insert non duplicates to existing table
-        insert_sql = f'INSERT INTO {sheetname} ({columns_str}) VALUES ({placeholders}) ON CONFLICT({id_col}) DO NOTHING'
-        for _, row in df.iterrows():
-            db.cursor().execute(insert_sql, tuple(row))
-        db.commit()
+    db = get_db(database=tmp_database)
+    set_ingest_pragmas(db)
+    # All sheets are loaded in one transaction, so a bad sheet leaves nothing behind.
+    with db:
+        for sheetname in sheet_names:
+            start_time = time.perf_counter()
+            df = read_sheet(csv_dir, sheetname)
+            if not check_ids(df, sheetname):
+                sys.exit()
+            archived = archive.archived_ids(database, sheetname)
+            df = skip_archived_rows(df, archived)
+            # Get the column names from the DataFrame
+            columns = df.columns.tolist()
+            id_col = columns[0]
+            columns_str = ', '.join(columns)
+            placeholders = ', '.join(['?'] * len(columns))
+            # Load data file to SQLite as tmp table -- skip for now. Keep for reference.
+            # df.to_sql('tmp', db, if_exists='replace', index=False)
+            # Rows already in the table get the values of the sheet, so the
+            # table always matches the row hashes stored below for --sync.
+            updates = ', '.join(f'{col} = excluded.{col}' for col in columns[1:])
+            insert_sql = f'INSERT INTO {sheetname} ({columns_str}) VALUES ({placeholders}) ON CONFLICT({id_col}) DO UPDATE SET {updates}'
+            db.executemany(insert_sql, sheet_rows(df))
+            hashes = row_hashes(csv_dir, sheetname)
+            report_archived_changes(db, sheetname, hashes, archived)
+            store_row_hashes(db, sheetname, hashes[~hashes.index.isin(list(archived))])
+            print('Sheet {}: {} rows in {:.2f} s'.format(sheetname, df.shape[0], time.perf_counter() - start_time))
+    update_metadata(db, archive.archived_crop_ids(database))
     db.close()
-    print('SQLite Database saved to: {}'.format(config_farmapp.DATABASE))  
+    replace_database(tmp_database, database)
+    print('SQLite Database saved to: {}'.format(database))
+
+def set_ingest_pragmas(db):
+    # Only for the copies of copy_database: until replace_database swaps them
+    # in, a crash leaves the live database as it was, so skip the rollback
+    # journal on disk and the fsyncs while loading.
+    db.execute('PRAGMA journal_mode = MEMORY')
+    db.execute('PRAGMA synchronous = OFF')
+
+#
+# Database copies
+#
+# Ingest, sync and rollover write to a copy of the database that replaces the
+# live file at the end. Readers keep the old file open until they reconnect,
+# so they never wait for or see a half-written database.
+#
+def copy_database(database, tmp_database):
+    # Start tmp_database as a copy of database, if there is one, with the current schema.
+    if os.path.exists(tmp_database):
+        os.remove(tmp_database)
+    if os.path.exists(database):
+        live_db = get_db(readonly=True, database=database)
+        tmp_db = get_db(database=tmp_database)
+        live_db.backup(tmp_db)
+        live_db.close()
+        tmp_db.close()
+    # Adds anything new in schema.sql to older databases.
+    init_db(tmp_database)
+
+def replace_database(tmp_database, database):
+    # Make sure the copy is on disk before it replaces the live database.
+    fd = os.open(tmp_database, os.O_RDONLY)
+    os.fsync(fd)
+    os.close(fd)
+    os.replace(tmp_database, database)
+
+#
+# Incremental sync
+#
+def sync_data(csv_dir, sheet_names):
+    # Copy the live database, apply only the rows that were inserted, changed or
+    # deleted in the sheets and swap the copy in.
+    database = config_farmapp.DATABASE
+    tmp_database = f'{database}.sync'
+    copy_database(database, tmp_database)
+    db = get_db(database=tmp_database)
+    set_ingest_pragmas(db)
+    with db:
+        for sheetname in sheet_names:
+            start_time = time.perf_counter()
+            df = read_sheet(csv_dir, sheetname)
+            if not check_ids(df, sheetname):
+                sys.exit()
+            archived = archive.archived_ids(database, sheetname)
+            inserted, updated, deleted = sync_sheet(db, csv_dir, sheetname, df, archived)
+            print('Sheet {}: {} inserted, {} updated, {} deleted in {:.2f} s'.format(
+                sheetname, inserted, updated, deleted, time.perf_counter() - start_time))
+    update_metadata(db, archive.archived_crop_ids(database))
+    db.close()
+    replace_database(tmp_database, database)
+    print('SQLite Database synced to: {}'.format(database))
+
+def sync_sheet(db, csv_dir, sheetname, df, archived=()):
+    columns = df.columns.tolist()
+    id_col = columns[0]
+    hashes = row_hashes(csv_dir, sheetname)
+    report_archived_changes(db, sheetname, hashes, archived)
+    # Rows of archived seasons live in their archive file, see rollover_season.
+    live_rows = ~hashes.index.isin(list(archived))
+    hashes = hashes[live_rows]
+    df = df.loc[live_rows]
+    stored = db.execute('SELECT RowID, RowHash FROM SyncHashes WHERE SheetName = ?', (sheetname,)).fetchall()
+    stored = pd.Series(dict(stored), dtype='Int64').reindex(hashes.index)
+    table_ids = pd.Index([row[0] for row in db.execute(f'SELECT {id_col} FROM {sheetname}')])
+    # Rows without a stored hash count as changed, so the first sync rewrites everything once.
+    changed = (stored.isnull() | (stored != hashes)).to_numpy(dtype=bool)
+    in_table = hashes.index.isin(table_ids)
+    deleted_ids = table_ids.difference(hashes.index).tolist()
+    columns_str = ', '.join(columns)
+    placeholders = ', '.join(['?'] * len(columns))
+    upsert_sql = f'INSERT OR REPLACE INTO {sheetname} ({columns_str}) VALUES ({placeholders})'
+    db.executemany(upsert_sql, sheet_rows(df.loc[changed]))
+    db.executemany(f'DELETE FROM {sheetname} WHERE {id_col} = ?', [(row_id,) for row_id in deleted_ids])
+    db.executemany('DELETE FROM SyncHashes WHERE SheetName = ? AND RowID = ?', [(sheetname, row_id) for row_id in deleted_ids])
+    store_row_hashes(db, sheetname, hashes[changed])
+    return int((changed & ~in_table).sum()), int((changed & in_table).sum()), len(deleted_ids)
+
+def report_archived_changes(db, sheetname, hashes, archived):
+    # Archived rows are not updated from the sheets any more. Their stored hash
+    # stays the one from before the rollover, so every later edit in the sheet
+    # is listed here on each ingest and sync until the sheet matches again.
+    hashes = hashes[hashes.index.isin(list(archived))]
+    if len(hashes) == 0:
+        return []
+    stored = db.execute('SELECT RowID, RowHash FROM SyncHashes WHERE SheetName = ?', (sheetname,)).fetchall()
+    stored = pd.Series(dict(stored), dtype='Int64').reindex(hashes.index)
+    changed_ids = hashes.index[(stored.notnull() & (stored != hashes)).to_numpy(dtype=bool)].tolist()
+    if len(changed_ids) != 0:
+        print('Sheet {}: {} archived rows were changed in the sheet, the changes are not applied: {}'.format(
+            sheetname, len(changed_ids), changed_ids))
+    # Archived rows without a hash (databases from before the hashes) get the current one.
+    db.executemany(
+        'INSERT OR IGNORE INTO SyncHashes (SheetName, RowID, RowHash) VALUES (?, ?, ?)',
+        [(sheetname, int(row_id), int(row_hash)) for row_id, row_hash in hashes.items()])
+    return changed_ids
+
+def row_hashes(csv_dir, sheetname):
+    # Hash of the CSV text of every row, indexed by the row ID. Reading the
+    # text keeps the hashes stable when pandas would infer other column types.
+    path_to_csv = os.path.join(csv_dir, f'{sheetname}.csv')
+    df = pd.read_csv(path_to_csv, dtype=str, keep_default_na=False)
+    df.columns = df.columns.str.strip()
+    row_ids = pd.to_numeric(df[df.columns[0]]).astype('int64')
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy().view('int64')
+    return pd.Series(hashes, index=pd.Index(row_ids.to_numpy()))
+
+def store_row_hashes(db, sheetname, hashes):
+    db.executemany(
+        'INSERT OR REPLACE INTO SyncHashes (SheetName, RowID, RowHash) VALUES (?, ?, ?)',
+        [(sheetname, int(row_id), int(row_hash)) for row_id, row_hash in hashes.items()])
+
+def read_sheet(csv_dir, sheetname):
+    # reading data from the CSV file
+    path_to_csv = os.path.join(csv_dir, f'{sheetname}.csv')
+    df = pd.read_csv(path_to_csv)
+    # data cleanup
+    df.columns = df.columns.str.strip()
+    return df
+
+def skip_archived_rows(df, archived):
+    if len(archived) == 0:
+        return df
+    live_rows = ~df[df.columns[0]].isin(list(archived))
+    print('Sheet rows in the archive: {}'.format(int((~live_rows).sum())))
+    return df.loc[live_rows]
+
+def sheet_rows(df):
+    # Rows as tuples of Python values, with None for empty cells.
+    df = df.astype(object).where(df.notnull(), None)
+    return list(df.itertuples(index=False, name=None))
+
+def check_ids(df, sheetname):
+    # The first column holds the IDs: they have to be numbers, without gaps or duplicates.
+    id_col = df.columns[0]
+    ids_ok = True
+    ids = pd.to_numeric(df[id_col], errors='coerce')
+    if ids.isnull().any():
+        print("There is an invalid ID number in col {} in sheet {}, likely NaN".format(id_col, sheetname))
+        ids_ok = False
+    ids = np.sort(ids.dropna().to_numpy().astype('int64'))
+    maybe_missing = missing_number(ids)
+    if len(maybe_missing) != 0:
+        print('Sheet {} is missing an expected ID in col {}: {}'.format(sheetname, id_col, str(maybe_missing)))
+        ids_ok = False
+    # Sorted, so every repeated ID directly follows its first occurrence.
+    duplicates = ids[1:][ids[1:] == ids[:-1]].tolist()
+    if len(duplicates) != 0:
+        print('Sheet {} has ID duplicates in col {}: {}'.format(sheetname, id_col, str(duplicates)))
+        ids_ok = False
+    return ids_ok
+
+def update_metadata(db, archived_crop_ids=()):
+    # Store values the app would otherwise derive on every page view.
+    last_update_sql = '''SELECT MAX(UpdateDate)
+                    FROM (
+                        SELECT MAX(StartDate) AS UpdateDate FROM Plantings
+                    UNION ALL
+                        SELECT MAX(EndDate) FROM Plantings
+                    UNION ALL
+                        SELECT MAX(StartDate) FROM SoilImprovements
+                    UNION ALL
+                        SELECT MAX(EndDate) FROM SoilImprovements);'''
+    last_update = db.execute(last_update_sql).fetchone()[0]
+    db.execute('INSERT OR REPLACE INTO Metadata (MetaKey, MetaValue) VALUES (?, ?)', ('LastUpdate', last_update))
+    crop_search.write_index(db, archived_crop_ids)
+    write_harvest_status(db)
+    db.commit()
+
+def write_harvest_status(db):
+    # Harvest status of all open plantings as of today, see harvest.py.
+    start_time = time.perf_counter()
+    crop_cur = db.execute(harvest.UNHARVESTED_QUERY)
+    crop_cols = [col[0] for col in crop_cur.description]
+    crop_data = crop_cur.fetchall()
+    anbau_cur = db.execute(harvest.ANBAU_QUERY)
+    anbau_cols = [col[0] for col in anbau_cur.description]
+    anbau_data = anbau_cur.fetchall()
+    df_harvest = harvest.generate_harvest_table(crop_cols, crop_data, anbau_cols, anbau_data)
+    columns_str = ', '.join(harvest.HARVEST_COLUMNS)
+    placeholders = ', '.join(['?'] * len(harvest.HARVEST_COLUMNS))
+    db.execute('DELETE FROM HarvestStatus')
+    db.executemany(f'INSERT INTO HarvestStatus ({columns_str}) VALUES ({placeholders})',
+        sheet_rows(df_harvest[harvest.HARVEST_COLUMNS]))
+    db.execute('INSERT OR REPLACE INTO Metadata (MetaKey, MetaValue) VALUES (?, ?)',
+        ('HarvestDate', datetime.today().strftime('%Y-%m-%d')))
+    print('HarvestStatus: {} rows in {:.2f} s'.format(df_harvest.shape[0], time.perf_counter() - start_time))
+
+def refresh_harvest_status(database=None):
+    # Daily job, the harvest status changes with the date as well as with the data.
+    # Written to a copy that replaces the database, like sync_data.
+    if database is None:
+        database = config_farmapp.DATABASE
+    tmp_database = f'{database}.harvest'
+    copy_database(database, tmp_database)
+    db = get_db(database=tmp_database)
+    set_ingest_pragmas(db)
+    with db:
+        write_harvest_status(db)
+    db.close()
+    replace_database(tmp_database, database)
+
+#
+# Season rollover
+#
+def rollover_season(year, database=None):
+    # Move the closed plantings and soil improvements that started in year to
+    # the archive file of the season, see archive.py. Open records stay in the
+    # live database until they are closed and the season is rolled over again.
+    # Both files are written as copies and swapped in at the end, like sync_data.
+    if database is None:
+        database = config_farmapp.DATABASE
+    if int(year) >= datetime.today().year:
+        print('Season {} is not over yet.'.format(year))
+        sys.exit(1)
+    archive_database = archive.archive_path(database, year)
+    os.makedirs(os.path.dirname(archive_database), exist_ok=True)
+    tmp_database = f'{database}.rollover'
+    tmp_archive = f'{archive_database}.rollover'
+    copy_database(database, tmp_database)
+    copy_database(archive_database, tmp_archive)
+    db = get_db(database=tmp_database)
+    set_ingest_pragmas(db)
+    db.execute('ATTACH DATABASE ? AS season', (tmp_archive,))
+    with db:
+        for table in archive.ARCHIVED_TABLES:
+            closed = 'SUBSTR(StartDate, 1, 4) = ? AND EndDate IS NOT NULL'
+            moved = db.execute(f'INSERT OR REPLACE INTO season.{table} SELECT * FROM main.{table} WHERE {closed}', (str(year),)).rowcount
+            db.execute(f'DELETE FROM main.{table} WHERE {closed}', (str(year),))
+            still_open = db.execute(f'SELECT COUNT(*) FROM main.{table} WHERE SUBSTR(StartDate, 1, 4) = ?', (str(year),)).fetchone()[0]
+            print('{}: {} rows moved to {}, {} open rows stay'.format(table, moved, archive_database, still_open))
+    # The crops of the season stay in the crop search.
+    archived_crop_ids = archive.archived_crop_ids(database)
+    archived_crop_ids.update(row[0] for row in db.execute('SELECT DISTINCT CropID FROM season.Plantings WHERE CropID IS NOT NULL'))
+    db.execute('DETACH DATABASE season')
+    update_metadata(db, archived_crop_ids)
+    # Give the space of the moved rows back, so the live file stays small.
+    db.execute('VACUUM')
+    db.close()
+    # The archive first: until the live database is swapped too, its rows are
+    # in both files and rolling over again finishes the move.
+    replace_database(tmp_archive, archive_database)
+    replace_database(tmp_database, database)
+    print('Season {} archived to: {}'.format(year, archive_database))
+
 #
 # Google Sheet Stuff
 #
-def getGoogleSheet(spreadsheet_id, outDir, dict_of_sheets):
-    for sheetname, sheet_number in dict_of_sheets.items():
-        url = f'https://docs.google.com/spreadsheets/d/{spreadsheet_id}/export?format=csv&gid={sheet_number}'
-        response = requests.get(url)
-        if response.status_code == 200:
+def getGoogleSheet(spreadsheet_id, outDir, dict_of_sheets, base_url=None):
+    # Download all sheets at the same time over one session. Sheets that did not
+    # change since the last download are answered with 304 and not fetched again.
+    # Returns the names of the sheets that changed.
+    if base_url is None:
+        base_url = config_farmapp.GOOGLESHEET_BASE_URL
+    validators = load_sheet_validators(outDir)
+    session = get_http_session(len(dict_of_sheets))
+    with ThreadPoolExecutor(max_workers=max(len(dict_of_sheets), 1)) as executor:
+        futures = {}
+        for sheetname, sheet_number in dict_of_sheets.items():
+            url = f'{base_url}/{spreadsheet_id}/export?format=csv&gid={sheet_number}'
             filepath = os.path.join(outDir, f'{sheetname}.csv')
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-                print('CSV file saved to: {}'.format(filepath))    
+            futures[sheetname] = executor.submit(download_sheet, session, url, filepath, validators.get(sheetname))
+        results = {sheetname: future.result() for sheetname, future in futures.items()}
+    session.close()
+    changed_sheets = []
+    failed = False
+    for sheetname, (status_code, sheet_validators) in results.items():
+        filepath = os.path.join(outDir, f'{sheetname}.csv')
+        if status_code == 200:
+            validators[sheetname] = sheet_validators
+            changed_sheets.append(sheetname)
+            print('CSV file saved to: {}'.format(filepath))
+        elif status_code == 304:
+            print('CSV file unchanged: {}'.format(filepath))
         else:
-            print(f'Error downloading Google Sheet: {response.status_code}')
-            sys.exit(1)
+            print(f'Error downloading Google Sheet {sheetname}: {status_code}')
+            failed = True
+    save_sheet_validators(outDir, validators)
+    if failed:
+        sys.exit(1)
+    return changed_sheets
+
+def get_http_session(pool_size):
+    # Retry connection errors and temporary server errors with exponential backoff.
+    retries = Retry(
+        total=DOWNLOAD_RETRIES,
+        backoff_factor=DOWNLOAD_BACKOFF,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET'],
+    )
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def download_sheet(session, url, filepath, sheet_validators=None):
+    # Stream one sheet to disk, replacing the old file only once it is complete.
+    headers = {}
+    if sheet_validators and os.path.exists(filepath):
+        if sheet_validators.get('ETag'):
+            headers['If-None-Match'] = sheet_validators['ETag']
+        if sheet_validators.get('Last-Modified'):
+            headers['If-Modified-Since'] = sheet_validators['Last-Modified']
+    try:
+        response = session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+    except requests.RequestException as e:
+        return str(e), None
+    with response:
+        if response.status_code != 200:
+            return response.status_code, None
+        tmp_path = f'{filepath}.part'
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp_path, filepath)
+        sheet_validators = {
+            'ETag': response.headers.get('ETag'),
+            'Last-Modified': response.headers.get('Last-Modified'),
+        }
+    return response.status_code, sheet_validators
+
+def load_sheet_validators(outDir):
+    # ETag and Last-Modified of the last download per sheet.
+    path = os.path.join(outDir, SHEET_VALIDATORS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, mode='r') as f:
+        return json.load(f)
+
+def save_sheet_validators(outDir, validators):
+    path = os.path.join(outDir, SHEET_VALIDATORS_FILE)
+    with open(path, mode='w') as f:
+        json.dump(validators, f, indent=2)
 
 def missing_number(myList): # myList is assumed to be sorted ascending
-    return sorted(set(myList).symmetric_difference(range((myList[0]), myList[-1]+1)))
\ No newline at end of file
+    if len(myList) == 0:
+        return []
+    return np.setdiff1d(np.arange(myList[0], myList[-1] + 1), myList).tolist()
\ No newline at end of file
@@ -0,0 +1,77 @@
+import argparse, os, shutil, sys, time # Standard
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+import db_pool, farmapp # Internal
+
+#
+# Static site export
+#
+# Renders every page of the app to HTML files, so a plain static web server can
+# serve them without Python. The pages depend on the database and the date,
+# so run it after every database refresh and once a day:
+#
+#   python export_static.py --out static_site
+#
+# The search forms of the landing page still need the flask app.
+#
+EXPORT_DIR = 'static_site'
+
+def export_paths():
+    paths = ['/', '/ernteliste', '/erntekalender', '/anbau', '/folien']
+    paths += [f'/beetID/{bedid}' for bedid in farmapp.empty_year_list_gen()]
+    paths += [f'/kulturname/{kultur_name}' for kultur_name in farmapp.get_all_planted_crops()]
+    return paths
+
+def page_file(out_dir, path):
+    # /beetID/5 is written to beetID/5/index.html, which static servers find for /beetID/5/.
+    return os.path.join(out_dir, *path.strip('/').split('/'), 'index.html')
+
+def render_pages(paths, out_dir):
+    # Runs in a worker process and renders through the flask test client.
+    client = farmapp.app.test_client()
+    failed = []
+    for path in paths:
+        response = client.get(quote(path))
+        if response.status_code != 200:
+            failed.append((path, response.status_code))
+            continue
+        filepath = page_file(out_dir, path)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'wb') as f:
+            f.write(response.get_data())
+    return failed
+
+def export_site(out_dir, workers=None):
+    start_time = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    paths = export_paths()
+    # Build next to the old export and swap at the end.
+    new_dir = f'{out_dir}.new'
+    shutil.rmtree(new_dir, ignore_errors=True)
+    farmapp.vendor_plotlyjs()
+    shutil.copytree(farmapp.app.static_folder, os.path.join(new_dir, 'static'))
+    # SQLite connections must not be shared with the forked workers.
+    db_pool.close_all()
+    chunks = [paths[i::workers] for i in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(render_pages, chunks, [new_dir] * workers)
+        failed = [page for result in results for page in result]
+    old_dir = f'{out_dir}.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old_dir)
+    os.rename(new_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    for path, status_code in failed:
+        print(f'Error rendering {path}: {status_code}')
+    print('Exported {} pages to {} in {:.1f} s'.format(len(paths) - len(failed), out_dir, time.perf_counter() - start_time))
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render all pages of the app to static HTML files.')
+    parser.add_argument('--out', default=EXPORT_DIR, help='Directory for the exported site.')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes, defaults to the number of CPUs.')
+    args = parser.parse_args()
+    failed = export_site(args.out, args.workers)
+    if len(failed) != 0:
+        sys.exit(1)
@@ -1,17 +1,43 @@
 import sqlite3
-from datetime import datetime, timedelta
-import math
-from flask import Flask, request, render_template, redirect, url_for
-import numpy as np
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+from datetime import datetime
+import functools
+import hashlib
+import json
+import os
+import shutil
+import threading
+from flask import Flask, abort, request, render_template, redirect, url_for, stream_template
+from jinja2.environment import TemplateStream
+import archive, crop_search, db_pool, harvest, http_cache, server_timing, snapshot # Internal
+from lazy_imports import lazy_import
+
+# Loaded on first use, see lazy_imports.py.
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+px = lazy_import('plotly.express')
+go = lazy_import('plotly.graph_objects')
+pio = lazy_import('plotly.io')
 
 app = Flask(__name__)
+server_timing.init_app(app)
+# ETags, 304 answers and compressed pages, see http_cache.py.
+http_cache.init_app(app, lambda: DATABASE)
+# Answer the queries from an in-memory snapshot of the database, see snapshot.py.
+app.config.setdefault('DATA_SNAPSHOT', snapshot.enabled_from_env())
 DATABASE = 'erdling.db'
 VIZ_START_DATE = '2024-01-01'
-TODAY = datetime.today().strftime('%Y-%m-%d')
-LAT_SALZBURG = 47.811195
+# Derived data (harvest table, update date), shared by all requests of this process.
+data_cache = {}
+data_cache_lock = threading.Lock()
+
+# plotly.js is served once as a static file, pages only carry the figure JSON.
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+# Pre-rendered Anbau figures, one directory per data version.
+FIGURE_CACHE_DIR = 'figure_cache'
+FIGURE_CACHE_SIZE = 64 # Figures kept in memory per process
+FIGURE_CACHE_VERSIONS = 2 # Data versions kept on disk, the current and the previous one
+STREAM_BUFFER = 100 # Template pieces per chunk of a streamed page
+SUGGEST_LIMIT = 10 # Crops per answer of /api/suggest
 
 #
 # Chart Color Dictionaries
@@ -52,13 +78,104 @@ solarised_colors = {
     'cyan':      '#2aa198',
     'green':     '#859900',
 }
+#
+# Anbau windows: start column, end column, color and bar width in the overview.
+#
+ANBAU_WINDOWS = [
+    ("SäenVorziehenStart", "SäenVorziehenEnde", solarised_colors['violet'], 1),
+    ("SäenDirektStart1", "SäenDirektEnde1", solarised_colors['red'], 0.8),
+    ("SäenDirektStart2", "SäenDirektEnde2", solarised_colors['red'], 0.8),
+    ("SetzenStart1", "SetzenEnde1", solarised_colors['yellow'], 0.5),
+    ("SetzenStart2", "SetzenEnde2", solarised_colors['yellow'], 0.5),
+    ("SteckenStart1", "SteckenEnde1", solarised_colors['blue'], 0.4),
+    ("ErntefensterStart1", "ErntefensterEnde1", solarised_colors['green'], 0.3),
+    ("ErntefensterStart2", "ErntefensterEnde2", solarised_colors['green'], 0.3),
+]
+#
+# Static plotly.js
+#
+@functools.cache
+def vendor_plotlyjs():
+    # Write the plotly.js bundle of the installed plotly version to static/ and
+    # return its file name. The version in the file name keeps the cached file in
+    # sync with the figure JSON. plotly.offline is slow to import, so only the
+    # pages with figures ask for it.
+    from plotly.offline import get_plotlyjs, get_plotlyjs_version
+    filename = f'vendor/plotly-{get_plotlyjs_version()}.min.js'
+    path = os.path.join(app.static_folder, filename)
+    if os.path.exists(path):
+        return filename
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(get_plotlyjs())
+    os.replace(tmp_path, path)
+    return filename
+
+@app.context_processor
+def inject_plotlyjs():
+    return {'plotlyjs_url': lambda: url_for('static', filename=vendor_plotlyjs())}
+
+@app.after_request
+def cache_vendored_files(response):
+    # Versioned files never change, so browsers may keep them.
+    if request.path.startswith('/static/vendor/') and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+@server_timing.timed('to_html')
+def figure_to_html(fig):
+    return fig.to_html(full_html=False, include_plotlyjs=False)
+
+#
+# Streamed pages
+#
+def stream_page(template_name, **context):
+    # Like render_template, but the page is sent while it is rendered, so the
+    # head and the figure reach the browser before the long tables are done.
+    # Tables are included from _table.html with table_cols and table_rows.
+    # With Server-Timing on, the page is rendered in full first: the header is
+    # sent before a streamed body, so it could not include the template time.
+    if app.config['SERVER_TIMING']:
+        return render_template(template_name, **context)
+    stream = TemplateStream(stream_template(template_name, **context))
+    stream.enable_buffering(STREAM_BUFFER)
+    return app.response_class(stream, mimetype='text/html')
+
+#
+# Warm-up
+#
+def warm_up(figures=False):
+    # Load the lazy imports and fill the caches before the first request, e.g.
+    # from the WSGI file or in serve.py before the workers are forked. Takes a
+    # few seconds; with figures, the Anbau figure of every crop is built too.
+    for module in (np, pd, px, go, pio):
+        module.__name__ # Any attribute access runs the deferred import
+    vendor_plotlyjs()
+    data_snapshot()
+    harvest.sunlight_weight_table(harvest.LAT_SALZBURG)
+    get_harvest_table()
+    get_harvest_forecast()
+    get_most_recent_update_date()
+    data_version = get_data_version()
+    get_anbau_figure_json(None, 3000, data_version)
+    if figures:
+        anbau_cols, anbau_data = get_all_anbau_info()
+        anbau_names = {str(row[anbau_cols.index('CropName')]).lower() for row in anbau_data}
+        for kultur_name in get_all_planted_crops():
+            if kultur_name is not None and kultur_name.lower() in anbau_names:
+                get_anbau_figure_json(kultur_name, 400, data_version)
+
 #
 # Routing
 #
 # Receive and check input for bedID number (0-90).
 @app.route('/',methods = ['POST', 'GET'])
 def my_form_post():
-    kultur_names = get_all_planted_crops()
+    # The crop names come from /api/suggest while typing, not with the page.
     update_date = str(get_most_recent_update_date())
     if request.method == 'POST' and 'bid' in request.form:
         # Validate number as input.
@@ -66,26 +183,28 @@ def my_form_post():
             try:
                 bedid = int(request.form['bid'])
             except ValueError:
-                return render_template('abfrage.html', name=kultur_names, update_date=update_date)
+                return render_template('abfrage.html', update_date=update_date)
             if bedid < 0:
-                return render_template('abfrage.html', name=kultur_names, update_date=update_date)
+                return render_template('abfrage.html', update_date=update_date)
             elif bedid > 90:
-                return render_template('abfrage.html', name=kultur_names, update_date=update_date)
+                return render_template('abfrage.html', update_date=update_date)
             else:
                 break
         return redirect(url_for('beetID', ID = str(bedid)))
     elif request.method == 'POST' and 'kulturname' in request.form:
-        # Validate number as input.
-        while True:
-            try:
-                kultur_name = str(request.form.get('kulturname'))
-            except ValueError:
-                return render_template('abfrage.html', name=kultur_names, update_date=update_date)
-            else:
-                break
+        # Only a crop name or an alternative name leads to a crop page.
+        text = str(request.form.get('kulturname')).strip()
+        if text == '':
+            return render_template('abfrage.html', update_date=update_date)
+        kultur_name = resolve_crop_name(text)
+        if kultur_name is None:
+            # Offer the best matches instead of guessing one.
+            _cols, matches = search_crops(text)
+            suggestions = [crop_name for crop_name, _alternative_names, _sorts in matches]
+            return render_template('abfrage.html', update_date=update_date, not_found=text, suggestions=suggestions)
         return redirect(url_for('kulturname', kultur_name=kultur_name))
     else:
-        return render_template('abfrage.html', name=kultur_names, update_date=update_date)
+        return render_template('abfrage.html', update_date=update_date)
 
 # Go to kulturname URL to retrieve info.
 @app.route('/kulturname/<kultur_name>', methods=("POST", "GET"))
@@ -94,69 +213,37 @@ def kulturname(kultur_name):
     # Get planting information
     #
     crop_cols, crop_data = get_specific_crop(kultur_name)
-    df_crop = pd.DataFrame(crop_data, columns=crop_cols)
-    df_crop = df_crop.sort_values(by=['StartDate'], ascending=False)
-    df_result = df_crop.where(df_crop.notnull(), '')
+    anbau_cols, anbau_data = get_anbau_info(kultur_name)
+    if len(crop_data) == 0 and len(anbau_data) == 0:
+        abort(404)
     #
-    # Generate figure -- allow modifications for figure visualisation by creating copy.
+    # Generate figure
     #
-    df_fig = df_result.copy(deep=True)
+    df_crop = pd.DataFrame(crop_data, columns=crop_cols)
+    df_crop = df_crop.sort_values(by=['StartDate'], ascending=False)
+    # Table rows before the figure changes the end dates
+    table_rows = list(df_crop.itertuples(name=None))
+    df_fig = df_crop.where(df_crop.notnull(), '')
+    # Today of this request, not of the start of the (long-running) process.
+    today = datetime.today().strftime('%Y-%m-%d')
     # Change to give enddate to everything for the figure (otherwise timeline bars don't display)
     df_fig.loc[
             (df_fig['EndDate'] == '')
             , 'EndDate'
-        ] = TODAY
-    fig = px.timeline(
-        df_fig,
-        x_start="StartDate",
-        x_end="EndDate",
-        y="BedID",
-        color="CropFamilie",
-        color_discrete_map = crop_family_colors,
-        labels={
-            "BedID": "Beet #",
-            "CropFamilie": "Pflanzenfamilien"
-        }
-    )
-    fig.update_yaxes(autorange="reversed")
-    fig.update_layout({
-        'plot_bgcolor': 'rgb(234,216,192)',
-        'paper_bgcolor': 'rgba(0, 0, 0, 0)'
-    })
-    fig.update_xaxes(range=[VIZ_START_DATE, f'{TODAY}'], fixedrange=True)
-    fig.update_yaxes(fixedrange=True)
-    # Points for each starting date
-    dia = px.scatter(
-        df_fig,
-        x="StartDate",
-        y="BedID",
-        color="CropFamilie",
-        color_discrete_map = crop_family_colors,
-        symbol_sequence=['diamond']
-        )
-    dia.update_traces(marker=dict(size=12, line=dict(width=2)))
-    new_fig = go.Figure(data=fig.data + dia.data, layout=fig.layout)
-    # Move legend to top.
-    new_fig.update_layout(legend=dict(
-    orientation="h",
-    yanchor="bottom",
-    y=1.05,
-    xanchor="right",
-    x=1
-    ))
-    pd.set_option('colheader_justify', 'center')
+        ] = today
+    new_fig = make_crop_location_figure(df_fig, today)
     h1_str=f"Kultur: {kultur_name}"
-    anbau_cols, anbau_data = get_anbau_info(kultur_name)
     df_anbau = pd.DataFrame(anbau_data, columns=anbau_cols)
     df_anbau = df_anbau.where(df_anbau.notnull(), '')
-    anbau_fig = make_anbau_figure(df_anbau, 400)
-    anbau_fig.add_vline(x=TODAY, line_width=3, line_color="black")
+    # Crops without Anbau infos get empty fields.
+    anbau_row = df_anbau.iloc[0].to_dict() if df_anbau.shape[0] != 0 else {}
+    anbau_fig = anbau_figure_to_html(kultur_name, 400)
     h1_anbau_str = f"Wann bauen die Erdlinge {kultur_name} an?"
     h1_woanbau_str = f"Wo hat man {kultur_name} angebaut?"
     #
     # Harvest information.
     #
-    harvest_table = get_crop_from_harvest_table(generate_harvest_table(), kultur_name)
+    harvest_table = get_harvest_per_crop(kultur_name)
     h1_harvest_str = f"Gibt es {kultur_name} zum Ernten?"
     #
     # Get bed with longest history, or none.
@@ -186,19 +273,21 @@ def kulturname(kultur_name):
                 add_str = f"</br> und dann in dieser Reihenfolge weiterschauen: <mark>{add_str_bit}</mark>"
                 priority_info += add_str
 
-    return render_template(
-        'crop_location.html', tables=[df_result.to_html(classes=['tablestyle', 'sortable'], header="true")],
-        fig=new_fig.to_html(full_html=False),
-        anbau_fig=anbau_fig.to_html(full_html=False),
+    return stream_page(
+        'crop_location.html',
+        table_cols=crop_cols,
+        table_rows=table_rows,
+        fig=figure_to_html(new_fig),
+        anbau_fig=anbau_fig,
         h1_string=h1_str,
         h1_anbau_str=h1_anbau_str,
         h1_harvest_str=h1_harvest_str,
         h1_woanbau_str=h1_woanbau_str,
         priority_info=priority_info,
         #harvest_tables=[harvest_table.to_html(classes=['tablestyle', 'sortable'], header="true")],
-        good_neighbors=str(df_anbau['NachbarnGut'][0]),
-        bad_neighbors=str(df_anbau['NachbarnSchlecht'][0]),
-        intensity=str(df_anbau['Intensität'][0]),
+        good_neighbors=str(anbau_row.get('NachbarnGut', '')),
+        bad_neighbors=str(anbau_row.get('NachbarnSchlecht', '')),
+        intensity=str(anbau_row.get('Intensität', '')),
         update_date = str(get_most_recent_update_date())
         )
 
@@ -217,72 +306,19 @@ def beetID(ID):
     df_result = df_result.sort_values(by=['StartDate', 'CropFamilie', 'CropName'], ascending=False)
     # Fix NaN values to None
     df_result = df_result.where(df_result.notnull(), '')
+    # Table rows before the figure changes the end dates in place
+    table_cols = list(df_result.columns)
+    table_rows = list(df_result.itertuples(name=None))
     # Figure stuff
-    df_fig = df_result.copy(deep=True)
+    df_fig = df_result
     #df_fig = df_fig.drop(df_fig[df_fig['ImprovementName'] != ''].index)
     # Set end date to today for anything that doesn't have one
+    today = datetime.today().strftime('%Y-%m-%d')
     df_fig.loc[
             (df_fig['EndDate'] == '')
             , 'EndDate'
-        ] = TODAY
-    fig = px.timeline(
-        df_fig.loc[df_fig['ImprovementName'] == ''],
-        x_start="StartDate",
-        x_end="EndDate",
-        y="CropName",
-        color="CropFamilie",
-        color_discrete_map = crop_family_colors,
-        labels={
-            "CropName": "Kulturnamen",
-            "CropFamilie": "In dem Beet..."
-        }
-    )
-    fig.update_yaxes(autorange="reversed")
-    fig.update_layout({
-        'plot_bgcolor': 'rgb(234,216,192)',
-        'paper_bgcolor': 'rgba(0, 0, 0, 0)'
-    })
-    fig.update_xaxes(range=[VIZ_START_DATE, f'{TODAY}'], fixedrange=True)
-    fig.update_yaxes(fixedrange=True)
-    dia = px.scatter(
-        df_fig.loc[df_fig['ImprovementName'] == ''],
-        x="StartDate",
-        y="CropName",
-        color="CropFamilie",
-        color_discrete_map = crop_family_colors,
-        symbol_sequence=['diamond']
-    )
-    dia.update_traces(marker=dict(size=12, line=dict(width=2)))
-    single_day_events = ['Kompost', 'mit Laub gemulcht']
-    soil_process = px.timeline(
-        # Ignore single day events and empty values when creating bars
-        df_fig.loc[(~df_fig['ImprovementName'].isin(single_day_events) & (df_fig['ImprovementName'] != ''))],
-        x_start="StartDate",
-        x_end="EndDate",
-        y="ImprovementName",
-        color="ImprovementName",
-        color_discrete_map = soil_improvement_colors
-    )
-    # Add "points" to represent single day events
-    soil_event = px.scatter(
-        df_fig.loc[df_fig['ImprovementName'].isin(single_day_events)],
-        x="StartDate",
-        y="ImprovementName",
-        color="ImprovementName",
-        color_discrete_map = soil_improvement_colors,
-        symbol_sequence=['line-ns-open'])
-    soil_event.update_traces(marker=dict(size=12, line=dict(width=10)))
-    # Put it all together!
-    new_fig = go.Figure(data=fig.data + dia.data + soil_process.data + soil_event.data, layout=fig.layout)
-    # Move legend to top.
-    new_fig.update_layout(legend=dict(
-    orientation="h",
-    yanchor="bottom",
-    y=1.05,
-    xanchor="right",
-    x=1
-    ))
-    pd.set_option('colheader_justify', 'center')
+        ] = today
+    new_fig = make_bed_history_figure(df_fig, today)
     h1_str=f"Beet #{ID}"
     # Walkthrough buttons
     # Decided not to use the function due to possible skipping of "empty" beds...
@@ -305,7 +341,7 @@ def beetID(ID):
     #
     # Generate harvest table.
     #
-    harvest_table = get_bed_from_harvest_table(generate_harvest_table(), int(ID))
+    harvest_table = get_harvest_per_bed(int(ID))
     harvest_str = 'Gibt es in diesem Beet etwas zum Ernten?'
     #
     # Get crops to harvest, or none.
@@ -322,10 +358,11 @@ def beetID(ID):
             harvest_set = str(list(dict.fromkeys((harvest_table_filtered['CropName'].tolist())))).replace("[", '').replace("]", '').replace("'", '')
             priority_info = f"Ja! Es gibt: <mark>{harvest_set}</mark>"
 
-    return render_template(
+    return stream_page(
         'bed_history.html',
-        tables=[df_result.to_html(classes=['tablestyle', 'sortable'], header="true")],
-        fig=new_fig.to_html(full_html=False),
+        table_cols=table_cols,
+        table_rows=table_rows,
+        fig=figure_to_html(new_fig),
         h1_string=h1_str,
         priority_info=priority_info,
         #harvest_tables=[harvest_table.to_html(classes=['tablestyle', 'sortable'], header="true")],
@@ -338,8 +375,7 @@ def beetID(ID):
 
 @app.route('/ernteliste', methods=("POST", "GET"))
 def ernteliste_table():
-    df_harvest = generate_harvest_table()
-    df_harvest = extract_harvestable(df_harvest)
+    df_harvest = get_harvestable()
     df_harvest = df_harvest.sort_values(by=['CropName', 'ErnteStatus', 'TageNachReife'], ascending=[True, True, False])
     df_harvest = df_harvest.reset_index(drop=True)
     # Get only what has something in the table...
@@ -379,27 +415,55 @@ def ernteliste_table():
         harvest_text_mid = "Keine Infos."
     if harvest_text_long == str():
         harvest_text_long = "Keine Infos."
-    return render_template(
+    return stream_page(
         'ernteliste.html',
         harvest_text_short=harvest_text_short,
         harvest_text=harvest_text_mid,
         harvest_text_long=harvest_text_long,
-        harvest_tables=[df_harvest.to_html(classes=['tablestyle', 'sortable'], header="true")],
+        table_cols=list(df_harvest.columns),
+        table_rows=df_harvest.itertuples(name=None),
         update_date = str(get_most_recent_update_date())
     )
 
+@app.route('/erntekalender', methods=("POST", "GET"))
+def erntekalender_view():
+    df_forecast = get_harvest_forecast()
+    return stream_page(
+        'erntekalender.html',
+        weeks=forecast_weeks(df_forecast),
+        table_cols=list(df_forecast.columns),
+        table_rows=df_forecast.itertuples(name=None),
+        update_date = str(get_most_recent_update_date())
+    )
+
+def forecast_weeks(df_forecast):
+    # [(title, [(crop, beds), ...]), ...]: what is ripe already, then the weeks
+    # from the current one on.
+    today = pd.Timestamp.today().normalize()
+    this_monday = today - pd.Timedelta(days=today.weekday())
+    ripe = pd.to_datetime(df_forecast['Erntedatum'], format='%Y-%m-%d') < this_monday
+    weeks = [("Schon reif", df_forecast.loc[ripe])] if ripe.any() else []
+    for week, df_week in df_forecast.loc[~ripe].groupby('Erntewoche', sort=True):
+        monday = datetime.strptime(week + '-1', '%G-KW%V-%u')
+        sunday = monday + pd.Timedelta(days=6)
+        weeks.append((f"{week} ({monday:%d.%m.} - {sunday:%d.%m.%Y})", df_week))
+    return [(title, forecast_crop_beds(df_week)) for title, df_week in weeks]
+
+def forecast_crop_beds(df_week):
+    crop_beds = []
+    for crop, df_crop in df_week.groupby('CropName', sort=True):
+        beds = sorted({int(bed) for bed in df_crop['BedID']})
+        crop_beds.append((crop, ', '.join(map(str, beds))))
+    return crop_beds
+
 @app.route('/anbau', methods=("POST", "GET"))
 def anbau_view():
-    anbau_cols, anbau_data = get_all_anbau_info()
-    df_anbau = pd.DataFrame(anbau_data, columns=anbau_cols)
-    df_anbau = df_anbau.where(df_anbau.notnull(), '')
-    anbau_fig = make_anbau_figure_overview(df_anbau, 3000, grouped=False)
-    anbau_fig.add_vline(x=TODAY, line_width=3, line_color="black")
+    anbau_fig = anbau_figure_to_html(None, 3000)
     family_overview = get_family_anbau_overview(list(crop_family_colors.keys()))
     families = family_overview.keys()
     return render_template(
         'anbau_view.html',
-        fig=anbau_fig.to_html(full_html=False),
+        fig=anbau_fig,
         h1_string="Wann wird alles bei den Erdlingen angebaut?",
         update_date = str(get_most_recent_update_date()),
         families = families,
@@ -409,6 +473,91 @@ def anbau_view():
 # Go to kulturname URL to retrieve info.
 @app.route('/folien', methods=("POST", "GET"))
 def folien_view():
+    df_folien = get_current_folien()
+    # Get number of rows/tarps
+    num_tarps = df_folien.shape[0]
+    return stream_page(
+        'folien_history.html',
+        table_cols=list(df_folien.columns),
+        table_rows=df_folien.itertuples(name=None),
+        h1_string="Seit wann liegen schwarze Folien?",
+        num_tarps = num_tarps,
+        update_date = str(get_most_recent_update_date())
+    )
+
+#
+# JSON API
+#
+# Tables are sent column by column: {"columns": [...], "values": [[...], ...]}
+# with one value list per column. ?fields=A,B limits the columns.
+@app.route('/api/beds/<int:ID>')
+def api_bed(ID):
+    planting_cols, planting_data = get_planting_history_per_bed(ID)
+    soil_cols, soil_data = get_soil_history(ID)
+    harvest_table = get_harvest_per_bed(ID)
+    return app.json.response({
+        'BedID': ID,
+        'plantings': columnar_rows(planting_cols, planting_data),
+        'soil_improvements': columnar_rows(soil_cols, soil_data),
+        'harvest': columnar_frame(harvest_table),
+    })
+
+@app.route('/api/crops/<kultur_name>')
+def api_crop(kultur_name):
+    crop_cols, crop_data = get_specific_crop(kultur_name)
+    anbau_cols, anbau_data = get_anbau_info(kultur_name)
+    harvest_table = get_harvest_per_crop(kultur_name)
+    return app.json.response({
+        'CropName': kultur_name,
+        'plantings': columnar_rows(crop_cols, crop_data),
+        'anbau': columnar_rows(anbau_cols, anbau_data),
+        'harvest': columnar_frame(harvest_table),
+    })
+
+@app.route('/api/harvest')
+def api_harvest():
+    return app.json.response(columnar_frame(get_harvest_table()))
+
+@app.route('/api/harvest/forecast')
+def api_harvest_forecast():
+    return app.json.response(columnar_frame(get_harvest_forecast()))
+
+@app.route('/api/folien')
+def api_folien():
+    return app.json.response(columnar_frame(get_current_folien()))
+
+@app.route('/api/suggest')
+def api_suggest():
+    # Crops for the search field of the landing page, best match first.
+    cols, history = search_crops(request.args.get('q', ''))
+    return app.json.response(columnar_rows(cols, history))
+
+def requested_fields(cols):
+    fields = request.args.get('fields')
+    if not fields:
+        return list(cols)
+    fields = fields.split(',')
+    return [col for col in cols if col in fields]
+
+def columnar_rows(cols, rows):
+    # Query results straight from the database, transposed into columns.
+    fields = requested_fields(cols)
+    values = list(zip(*rows)) if len(rows) != 0 else [()] * len(cols)
+    return {
+        'columns': fields,
+        'values': [list(values[cols.index(field)]) for field in fields],
+    }
+
+def columnar_frame(df):
+    fields = requested_fields(df.columns.tolist())
+    df = df[fields]
+    df = df.astype(object).where(df.notnull(), None)
+    return {
+        'columns': fields,
+        'values': [df[field].tolist() for field in fields],
+    }
+
+def get_current_folien():
     folien_cols, folien_data = get_all_folien()
     df_folien = pd.DataFrame(folien_data, columns=folien_cols)
     df_folien = df_folien.where(df_folien.notnull(), '')
@@ -417,15 +566,7 @@ def folien_view():
     df_folien = df_folien.drop(['EndDate'], axis=1)
     # make index match count
     df_folien= df_folien.reset_index(drop=True)
-    # Get number of rows/tarps
-    num_tarps = df_folien.shape[0]
-    return render_template(
-        'folien_history.html',
-        tables=[df_folien.to_html(classes=['tablestyle', 'sortable'], header="true")],
-        h1_string="Seit wann liegen schwarze Folien?",
-        num_tarps = num_tarps,
-        update_date = str(get_most_recent_update_date())
-    )
+    return df_folien
 
 def create_harvest_list_text(harvest_df):
         if harvest_df.empty:
@@ -451,26 +592,70 @@ def create_harvest_list_text(harvest_df):
             priority_info += add_str
         return priority_info
 
+def data_snapshot():
+    # The in-memory snapshot of the current data version, or None to query SQLite.
+    if not app.config['DATA_SNAPSHOT']:
+        return None
+    return snapshot.get_snapshot(DATABASE, get_data_version())
+
+def snapshot_query(snapshot_function):
+    # Answer the decorated query with snapshot_function(snap, *args) instead
+    # while the in-memory snapshot is on.
+    def decorator(query_function):
+        @functools.wraps(query_function)
+        def wrapper(*args):
+            snap = data_snapshot()
+            if snap is not None:
+                return snapshot_function(snap, *args)
+            return query_function(*args)
+        return wrapper
+    return decorator
+
+@snapshot_query(snapshot.planting_history_per_bed)
 def get_planting_history_per_bed(bid):
-    sql_query = f'''SELECT Plantings.StartDate, Plantings.EndDate, Crops.CropName, Crops.AlternativeNamen, Crops.CropSorte, Crops.CropFamilie, Plantings.PlantingMethod, Plantings.Quelle, Plantings.Notizen
-                    FROM Plantings
+    sql_query = '''SELECT Plantings.StartDate, Plantings.EndDate, Crops.CropName, Crops.AlternativeNamen, Crops.CropSorte, Crops.CropFamilie, Plantings.PlantingMethod, Plantings.Quelle, Plantings.Notizen
+                    FROM {Plantings}
                     INNER JOIN Crops
                     on Plantings.CropID = Crops.CropID
-                    WHERE Plantings.BedID = {bid}
+                    WHERE Plantings.BedID = ?
                     ORDER BY StartDate DESC;'''
-    cols, history = connect_execute_query(sql_query)
+    cols, history = connect_execute_history_query(sql_query, (bid,), merge=sort_history('StartDate', descending=True))
     return cols, history
 
+@snapshot_query(snapshot.planting_history_per_family)
 def get_planting_history_per_family(family):
-    sql_query = f'''SELECT Plantings.BedID, Plantings.StartDate, Plantings.EndDate, Crops.CropName, Crops.AlternativeNamen, Crops.CropSorte, Crops.CropFamilie, Plantings.PlantingMethod, Plantings.Notizen
-                    FROM Plantings
+    sql_query = '''SELECT Plantings.BedID, Plantings.StartDate, Plantings.EndDate, Crops.CropName, Crops.AlternativeNamen, Crops.CropSorte, Crops.CropFamilie, Plantings.PlantingMethod, Plantings.Notizen
+                    FROM {Plantings}
                     INNER JOIN Crops
                     on Plantings.CropID = Crops.CropID
-                    WHERE Crops.CropFamilie = "{family}"
+                    WHERE Crops.CropFamilie = ?
                     ORDER BY Plantings.BedID ASC;'''
-    cols, history = connect_execute_query(sql_query)
+    cols, history = connect_execute_history_query(sql_query, (family,), merge=sort_history('BedID'))
     return cols, history
 
+@snapshot_query(snapshot.beds_per_family_and_year)
+def get_beds_per_family_and_year(family_list):
+    placeholders = ', '.join(['?'] * len(family_list))
+    sql_query = f'''SELECT CropFamilie, Jahr, GROUP_CONCAT(BedID), COUNT(BedID)
+                    FROM (
+                        SELECT DISTINCT Crops.CropFamilie, SUBSTR(Plantings.StartDate, 1, 4) AS Jahr, Plantings.BedID
+                        FROM {{Plantings}}
+                        INNER JOIN Crops
+                        on Plantings.CropID = Crops.CropID
+                        WHERE Crops.CropFamilie IN ({placeholders})
+                        AND Plantings.StartDate IS NOT NULL
+                        AND Plantings.BedID IS NOT NULL)
+                    GROUP BY CropFamilie, Jahr;'''
+    cols, history = connect_execute_history_query(sql_query, tuple(family_list), merge=merge_beds_per_family_and_year)
+    return cols, history
+
+def merge_beds_per_family_and_year(cols, history):
+    # A season may have rows in the live database and in its archive.
+    beds = {}
+    for family, yyyy, bed_str, _bed_count in history:
+        beds.setdefault((family, yyyy), set()).update(bed_str.split(','))
+    return [(family, yyyy, ','.join(bed_set), len(bed_set)) for (family, yyyy), bed_set in sorted(beds.items())]
+
 def empty_year_list_gen(min_right=0, max_right_plus_one=43, min_left=51, max_left_plus_one=83):
     empty_year_list = []
     for x in range(min_right, max_right_plus_one):
@@ -479,209 +664,256 @@ def empty_year_list_gen(min_right=0, max_right_plus_one=43, min_left=51, max_lef
         empty_year_list.append(str(x))
     return empty_year_list
 
-def days_from_start_sunlight_curve(planting_date):
-    longest_day = daylength(172, LAT_SALZBURG) # 20 or 21 of June
-    days = (datetime.strptime(planting_date, '%Y-%m-%d') - datetime.today()).days
-    days = abs(days)
-    if days == 0:
-        return 0
-    growing_days = 0
-    for i in range(1, days):
-        date_to_calculate = datetime.strptime(planting_date, '%Y-%m-%d') + timedelta(days=i)
-        day_of_year = date_to_calculate.timetuple().tm_yday
-        if day_of_year <=70 or day_of_year >= 290:
-            growing_days += 0
-        else:
-            length_hrs = daylength(day_of_year, LAT_SALZBURG)
-            growing_days += (length_hrs/longest_day)
+@server_timing.timed('harvest')
+def generate_harvest_table():
+    # Live harvest status, for databases without an up to date HarvestStatus table.
+    crop_cols, crop_data = get_all_unharvested_crops()
+    anbau_cols, anbau_data = get_all_anbau_info()
+    return harvest.generate_harvest_table(crop_cols, crop_data, anbau_cols, anbau_data)
 
-    return round(growing_days)
+def get_harvest_table():
+    # Shared harvest table, only recomputed when the data or the day changes.
+    key = (get_data_version(), datetime.today().strftime('%Y-%m-%d'))
+    entry = data_cache.get('harvest')
+    if entry is None or entry['key'] != key:
+        with data_cache_lock:
+            entry = data_cache.get('harvest')
+            if entry is None or entry['key'] != key:
+                if harvest_status_is_current():
+                    df_harvest = query_harvest_status()
+                else:
+                    df_harvest = generate_harvest_table()
+                entry = {
+                    'key': key,
+                    'table': df_harvest,
+                    'BedID': df_harvest.groupby('BedID', sort=False).indices,
+                    'CropName': df_harvest.groupby('CropName', sort=False).indices,
+                }
+                data_cache['harvest'] = entry
+    return entry['table']
 
+def get_harvest_forecast():
+    # Forecast of the shared harvest table, recomputed along with it.
+    df_harvest = get_harvest_table()
+    entry = data_cache.get('harvest_forecast')
+    if entry is None or entry[0] is not df_harvest:
+        entry = (df_harvest, harvest.generate_harvest_forecast(df_harvest))
+        data_cache['harvest_forecast'] = entry
+    return entry[1]
 
-def days_from_start(planting_date):
-    days = (datetime.strptime(planting_date, '%Y-%m-%d') - datetime.today()).days
-    days = abs(days)
-    return days
+def lookup_harvest_table(df_harvest, col, value):
+    # Use the prebuilt index if df_harvest is the cached table, otherwise scan.
+    entry = data_cache.get('harvest')
+    if entry is not None and entry['table'] is df_harvest:
+        return df_harvest.iloc[entry[col].get(value, [])]
+    return df_harvest.loc[df_harvest[col] == value]
 
-def generate_harvest_table():
-    # Get planting info.
-    crop_cols, crop_data = get_all_unharvested_crops()
-    df_harvest = pd.DataFrame(crop_data, columns=crop_cols)
-    df_harvest = df_harvest.where(df_harvest.notnull(), '')
-    # Get harvestable plantings by having no EndDate
-    df_harvest = df_harvest.loc[df_harvest['EndDate'] == '']
-    df_harvest = df_harvest.copy(deep=True)
+def get_data_version():
+    # Changes whenever the database file is rewritten or replaced.
+    stat = os.stat(DATABASE)
+    return f'{stat.st_ino}-{stat.st_mtime_ns}-{stat.st_size}'
 
-    # Get Anbau Info
-    anbau_cols, anbau_data = get_all_anbau_info()
-    df_anbau = pd.DataFrame(anbau_data, columns=anbau_cols)
-    df_anbau = df_anbau.where(df_anbau.notnull(), '')
-    df_anbau = df_anbau.copy(deep=True)
-
-    # Merge
-    df_harvest = df_harvest.merge(df_anbau, how="inner", on="CropName")
-    desired_columns = [
-            "BedID",
-            "StartDate",
-            "CropName",
-            "CropSorte",
-            "PlantingMethod",
-            "TagezurReifeGesäet",
-            "TagezurReifeGesetzt",
-            "TagezurReifeGesteckt"    ]
-    df_harvest = df_harvest.get(desired_columns)
-
-    # Calculate days from start
-    df_harvest["TageNachStart"] = df_harvest.loc[:, "StartDate"].map(days_from_start)
-    df_harvest["TageNachStartSonne"] = df_harvest.loc[:, "StartDate"].map(days_from_start_sunlight_curve)
-    # Fill nodata to 0.0 numeric typed
-    df_harvest['TagezurReifeGesäet'] = df_harvest['TagezurReifeGesäet'].apply(pd.to_numeric, errors='coerce', downcast='integer').fillna(0)
-    df_harvest['TagezurReifeGesetzt'] = df_harvest['TagezurReifeGesetzt'].apply(pd.to_numeric, errors='coerce', downcast='integer').fillna(0)
-    df_harvest['TagezurReifeGesteckt'] = df_harvest['TagezurReifeGesteckt'].apply(pd.to_numeric, errors='coerce', downcast='integer').fillna(0)
-
-    # Get days to harvest depending on planting method
-    conditions = [
-        df_harvest['PlantingMethod'].eq('gesät'),
-        df_harvest['PlantingMethod'].eq('gesetzt'),
-        df_harvest['PlantingMethod'].eq('gesteckt')
-    ]
-    choices = [
-        df_harvest['TagezurReifeGesäet'],
-        df_harvest['TagezurReifeGesetzt'],
-        df_harvest['TagezurReifeGesteckt'],
-    ]
-    df_harvest['TagezurReife'] = np.select(conditions, choices, default=0)
-    df_harvest = df_harvest.drop(columns=["TagezurReifeGesäet", "TagezurReifeGesetzt", "TagezurReifeGesteckt"])
-    df_harvest['TageNachReife'] = df_harvest['TageNachStartSonne'] - df_harvest['TagezurReife']
-
-    # Calculate whether harvestable
-    conditions = [
-        (df_harvest['TagezurReife'] < 1),
-        (df_harvest['TageNachStartSonne']>= df_harvest['TagezurReife']),
-        (df_harvest['TageNachStartSonne'] < df_harvest['TagezurReife']) & (df_harvest['TagezurReife'] >= 1),
-    ]
-    choices = [
-        "2: Keine Ahnung",
-        "1: Zum Ernten",
-        "3: Reift noch"
-    ]
-    df_harvest['ErnteStatus'] = np.select(conditions, choices, default="2: Keine Ahnung")
-    df_harvest = df_harvest.sort_values(by=['ErnteStatus', "TageNachReife", 'CropName'], ascending=[True, False, True])
-
-    df_harvest = df_harvest.astype({
-    'TageNachStart': 'int',
-    'TageNachStartSonne': 'int',
-    'TagezurReife': 'int',
-    'TageNachReife': 'int',
-    })
-    return df_harvest
+#
+# Stored harvest status
+#
+# db_stuff writes the HarvestStatus table at ingest and in the daily refresh.
+# While it is from today, the harvest sections of the pages are single indexed
+# queries; otherwise (e.g. the daily refresh did not run) the status is computed
+# live as above. With the in-memory snapshot, the cached table and its indexes
+# answer them instead.
+#
+def harvest_status_is_current():
+    today = datetime.today().strftime('%Y-%m-%d')
+    key = (get_data_version(), today)
+    entry = data_cache.get('harvest_status')
+    if entry is None or entry[0] != key:
+        entry = (key, query_metadata_value('HarvestDate') == today)
+        data_cache['harvest_status'] = entry
+    return entry[1]
+
+@snapshot_query(snapshot.metadata_value)
+def query_metadata_value(key):
+    try:
+        _cols, history = connect_execute_query('''SELECT MetaValue
+                    FROM Metadata
+                    WHERE MetaKey = ?;''', (key,))
+    except sqlite3.OperationalError:
+        history = []
+    return history[0][0] if len(history) != 0 else None
+
+def query_harvest_status(where='', params=()):
+    if where == '':
+        cols, history = get_harvest_status()
+    else:
+        cols, history = connect_execute_query(harvest_status_query(where), params)
+    return pd.DataFrame(history, columns=cols)
+
+@snapshot_query(snapshot.harvest_status)
+def get_harvest_status():
+    return connect_execute_query(harvest_status_query())
+
+def harvest_status_query(where=''):
+    return f'''SELECT {', '.join(harvest.HARVEST_COLUMNS)}
+                    FROM HarvestStatus
+                    {where}
+                    ORDER BY {harvest.HARVEST_ORDER};'''
+
+def query_harvestable(where='', params=()):
+    # Ready to harvest or without Anbau infos, like extract_harvestable.
+    placeholders = ', '.join(['?'] * len(harvest.HARVESTABLE_STATUS))
+    where = f'WHERE {where + " AND " if where else ""}ErnteStatus IN ({placeholders})'
+    return query_harvest_status(where, tuple(params) + tuple(harvest.HARVESTABLE_STATUS))
+
+def get_harvest_per_bed(bid):
+    if harvest_status_is_current() and data_snapshot() is None:
+        return query_harvestable('BedID = ?', (bid,))
+    return get_bed_from_harvest_table(get_harvest_table(), bid)
+
+def get_harvest_per_crop(kultur_name):
+    if harvest_status_is_current() and data_snapshot() is None:
+        return query_harvestable('CropName = ?', (kultur_name,))
+    return get_crop_from_harvest_table(get_harvest_table(), kultur_name)
+
+def get_harvestable():
+    if harvest_status_is_current() and data_snapshot() is None:
+        return query_harvestable()
+    return extract_harvestable(get_harvest_table())
 
 def get_crop_from_harvest_table(df_harvest, kultur_name):
-    df_harvest = df_harvest.loc[df_harvest['CropName'] == kultur_name]
+    df_harvest = lookup_harvest_table(df_harvest, 'CropName', kultur_name)
     df_harvest = extract_harvestable(df_harvest)
     # TODO: add logic depending on number of rows to prioritise what to harvest.
     return df_harvest
 
 def get_bed_from_harvest_table(df_harvest, bid):
-    df_harvest = df_harvest.loc[df_harvest['BedID'] == bid]
+    df_harvest = lookup_harvest_table(df_harvest, 'BedID', bid)
     # Filter just for erntable or unknowns...
     return extract_harvestable(df_harvest)
 
 def extract_harvestable(df_harvest):
     # Filter just for erntable or unknowns...
-    harvestable = ["1: Zum Ernten", "2: Keine Ahnung"]
-    df_harvest = df_harvest.loc[df_harvest['ErnteStatus'].isin(harvestable)]
+    df_harvest = df_harvest.loc[df_harvest['ErnteStatus'].isin(harvest.HARVESTABLE_STATUS)]
     df_harvest = df_harvest.reset_index(drop=True)
     return df_harvest
 
 def get_family_anbau_overview(family_list):
-    family_overview = {}
-    for family in family_list:
-        # Get data per family.
-        crop_cols, crop_data = get_planting_history_per_family(family)
-        df_crop = pd.DataFrame(crop_data, columns=crop_cols)
-        df_crop = df_crop.sort_values(by=['BedID'], ascending=True)
-        df_result = df_crop.where(df_crop.notnull(), '')
-        # Create family dictionary if first round
-        if family not in family_overview:
-            family_overview[family] = {}
-        # Sort data from database into dictionary
-        for _index, row in df_result.iterrows():
-            # Get information per row
-            bedid = str(row["BedID"])
-            family = row["CropFamilie"]
-            yyyy, _mm, _dd = row["StartDate"].split("-")
-            # Create year dictionary if first time
-            if yyyy not in family_overview[family]:
-                family_overview[family][yyyy] = []
-            # Get list of beds in that year
-            bed_list = family_overview[family][yyyy]
-            # Add each bed used per year based on existing database
-            if bedid not in bed_list:
-                bed_list.append(bedid)
-                family_overview[family][yyyy] = bed_list
-        for year in list(family_overview[family]):
-            anzahl_str = f"{year} Anzahl"
-            family_overview[family][anzahl_str] = [len(family_overview[family][year]),]
+    family_overview = {family: {} for family in family_list}
+    # One row per family and year, with the beds already grouped by the database.
+    _cols, family_years = get_beds_per_family_and_year(family_list)
+    for family, yyyy, bed_str, bed_count in family_years:
+        bed_list = sorted(bed_str.split(','), key=int)
+        family_overview[family][yyyy] = bed_list
+        family_overview[family][f"{yyyy} Anzahl"] = [bed_count,]
+    for family in family_overview:
         family_overview[family] = dict(sorted(family_overview[family].items()))
     family_overview = dict(sorted(family_overview.items()))
     return family_overview
 
+@snapshot_query(snapshot.soil_history)
 def get_soil_history(bid):
-    sql_query = f'''SELECT StartDate, EndDate, ImprovementName, Notizen
-                    FROM SoilImprovements
-                    WHERE BedID = {bid};'''
-    cols, history = connect_execute_query(sql_query)
+    sql_query = '''SELECT StartDate, EndDate, ImprovementName, Notizen
+                    FROM {SoilImprovements}
+                    WHERE BedID = ?
+                    ORDER BY StartDate ASC;'''
+    cols, history = connect_execute_history_query(sql_query, (bid,), merge=sort_history('StartDate'))
     return cols, history
 
+@snapshot_query(snapshot.anbau_info)
 def get_anbau_info(crop_str):
     crop_str = str(crop_str)
     crop_str = crop_str.lower()
-    sql_query = f'''SELECT *
+    sql_query = '''SELECT *
                     FROM AnbauInfos
-                    WHERE LOWER(CropName) LIKE "{crop_str}";'''
-    cols, history = connect_execute_query(sql_query)
+                    WHERE LOWER(CropName) = ?;'''
+    cols, history = connect_execute_query(sql_query, (crop_str,))
     return cols, history
 
+@snapshot_query(snapshot.all_anbau_info)
 def get_all_anbau_info():
     sql_query = '''SELECT *
                     FROM AnbauInfos;'''
     cols, history = connect_execute_query(sql_query)
     return cols, history
 
+@snapshot_query(snapshot.specific_crop)
 def get_specific_crop(crop_str):
     crop_str = str(crop_str)
     crop_str = crop_str.lower()
-    sql_query = f'''SELECT BedID, StartDate, EndDate, Crops.CropName, CropSorte, CropFamilie, PlantingMethod, Quelle, Plantings.Notizen
-                    FROM Plantings
+    sql_query = '''SELECT BedID, StartDate, EndDate, Crops.CropName, CropSorte, CropFamilie, PlantingMethod, Quelle, Plantings.Notizen
+                    FROM {Plantings}
                     INNER JOIN Crops
                     on Plantings.CropID = Crops.CropID
-                    WHERE LOWER(Crops.CropName) LIKE "{crop_str}"
+                    WHERE LOWER(Crops.CropName) = ?
                     ORDER BY StartDate DESC;'''
-    cols, history = connect_execute_query(sql_query)
+    cols, history = connect_execute_history_query(sql_query, (crop_str,), merge=sort_history('StartDate', descending=True))
     return cols, history
 
+@snapshot_query(snapshot.all_unharvested_crops)
 def get_all_unharvested_crops():
-    sql_query = '''SELECT BedID, StartDate, EndDate, Crops.CropName, CropSorte, CropFamilie, PlantingMethod, Plantings.Notizen
-                    FROM Plantings
-                    INNER JOIN Crops
-                    on Plantings.CropID = Crops.CropID
-                    WHERE Plantings.EndDate IS NULL AND Plantings.ErnteEnde IS NULL
-                    ORDER BY StartDate DESC;'''
-    cols, history = connect_execute_query(sql_query)
+    cols, history = connect_execute_query(harvest.UNHARVESTED_QUERY)
     return cols, history
 
+@snapshot_query(snapshot.all_planted_crops)
 def get_all_planted_crops():
     sql_query = '''SELECT DISTINCT Crops.CropName
-                    FROM Plantings
+                    FROM {Plantings}
                     INNER JOIN Crops
                     on Plantings.CropID = Crops.CropID
                     ORDER BY Crops.CropName ASC;'''
-    _cols, history = connect_execute_query(sql_query)
+    _cols, history = connect_execute_history_query(sql_query, merge=sort_history('CropName', distinct=True))
     planted_crops = list(history)
     planted_crops = [crop[0] for crop in planted_crops]
     return planted_crops
 
+def search_crops(text, limit=SUGGEST_LIMIT):
+    match = crop_search.match_expression(text)
+    if match == '':
+        return list(crop_search.SEARCH_COLUMNS), []
+    try:
+        cols, history = connect_execute_query(crop_search.SEARCH_QUERY, (match, limit))
+    except sqlite3.OperationalError:
+        # Databases from before the search index: crop names containing the input.
+        text = text.strip().lower()
+        crop_names = get_all_planted_crops() + get_anbau_only_crops()
+        matches = [name for name in crop_names if name is not None and text in name.lower()]
+        cols, history = list(crop_search.SEARCH_COLUMNS), [(name, None, None) for name in matches[:limit]]
+    return cols, history
+
+def resolve_crop_name(text):
+    # The crop for the input of the landing page: the crop with this name or
+    # alternative name, in any case, or None if there is none.
+    text = text.strip().lower()
+    for crop_name, alternative_names in find_crop_names(text):
+        names = [crop_name] + crop_search.alternative_names(alternative_names)
+        if text in [name.lower() for name in names]:
+            return crop_name
+    return None
+
+def find_crop_names(text):
+    # (CropName, AlternativeNamen) of the crops whose names have the words of text.
+    match = crop_search.match_expression(text)
+    if match == '':
+        return []
+    try:
+        _cols, history = connect_execute_query(crop_search.NAMES_QUERY, (match,))
+    except sqlite3.OperationalError:
+        # Databases without the search index: all planted crops and the crops
+        # that only have Anbau infos.
+        planted_crops = set(get_all_planted_crops())
+        _cols, history = connect_execute_query('''SELECT DISTINCT CropName, AlternativeNamen
+                    FROM Crops;''')
+        history = [row for row in history if row[0] in planted_crops]
+        history += [(crop_name, None) for crop_name in get_anbau_only_crops()]
+    return history
+
+def get_anbau_only_crops():
+    # Crops with Anbau infos that were never planted, they have a crop page too.
+    anbau_cols, anbau_data = get_all_anbau_info()
+    planted_crops = {name.lower() for name in get_all_planted_crops() if name is not None}
+    crop_names = [row[anbau_cols.index('CropName')] for row in anbau_data]
+    return sorted({name for name in crop_names if name is not None and name.lower() not in planted_crops})
+
+@snapshot_query(snapshot.all_active_beds)
 def get_all_active_beds():
     sql_query = '''SELECT DISTINCT BedID
                         FROM (
@@ -699,141 +931,322 @@ def get_all_active_beds():
     return tracked_beds
 
 def get_most_recent_update_date():
-    sql_query = '''SELECT Plantings.StartDate, Plantings.EndDate, SoilImprovements.StartDate as StartDate2, SoilImprovements.EndDate as Enddate2
-                    FROM Plantings
-                    INNER JOIN SoilImprovements
-                    on Plantings.BedID = SoilImprovements.BedID;'''
-    cols, history = connect_execute_query(sql_query)
-    df_dates = pd.DataFrame(history, columns=cols)
-    df_dates = df_dates.where(df_dates.notnull(), '')
-    df_dates = df_dates.apply(pd.to_datetime)
-    most_recent_date = pd.to_datetime(df_dates.stack()).max()
-    most_recent_date = most_recent_date.strftime('%Y-%m-%d')
-    return most_recent_date
+    key = get_data_version()
+    entry = data_cache.get('update_date')
+    if entry is None or entry[0] != key:
+        entry = (key, query_most_recent_update_date())
+        data_cache['update_date'] = entry
+    return entry[1]
 
+@snapshot_query(snapshot.most_recent_update_date)
+def query_most_recent_update_date():
+    # Written by db_stuff.insert_data, computed here for databases without it.
+    try:
+        _cols, history = connect_execute_query('''SELECT MetaValue
+                    FROM Metadata
+                    WHERE MetaKey = 'LastUpdate';''')
+    except sqlite3.OperationalError:
+        history = []
+    if len(history) != 0:
+        return history[0][0]
+    sql_query = '''SELECT MAX(UpdateDate)
+                    FROM (
+                        SELECT MAX(StartDate) AS UpdateDate FROM Plantings
+                    UNION ALL
+                        SELECT MAX(EndDate) FROM Plantings
+                    UNION ALL
+                        SELECT MAX(StartDate) FROM SoilImprovements
+                    UNION ALL
+                        SELECT MAX(EndDate) FROM SoilImprovements);
+                    '''
+    _cols, history = connect_execute_query(sql_query)
+    return history[0][0]
+
+@snapshot_query(snapshot.all_folien)
 def get_all_folien():
     sql_query = '''SELECT BedID, StartDate, EndDate, Notizen
                     FROM SoilImprovements
-                    WHERE ImprovementName = "Schwarze Folie"
+                    WHERE ImprovementName = ?
                     ORDER BY StartDate DESC;'''
-    cols, history = connect_execute_query(sql_query)
+    cols, history = connect_execute_query(sql_query, ('Schwarze Folie',))
     return cols, history
 
-def connect_execute_query(sql_query):
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    cur = c.execute(sql_query)
-    cols = list(map(lambda x: x[0], cur.description))
-    history = c.fetchall()
-    conn.close()
+@server_timing.timed('sql')
+def connect_execute_query(sql_query, params=(), archives=()):
+    with db_pool.pooled_connection(DATABASE) as conn:
+        archive.attach(conn, archives)
+        cur = conn.execute(sql_query, params)
+        cols = list(map(lambda x: x[0], cur.description))
+        history = cur.fetchall()
     return cols, history
 
-def make_anbau_figure(df, height, grouped=True):
-    fig0 = create_anbau_partial_figure(df, "SäenVorziehenStart", "SäenVorziehenEnde", solarised_colors['violet'])
-    fig1 = create_anbau_partial_figure(df, "SäenDirektStart1", "SäenDirektEnde1", solarised_colors['red'])
-    fig2 = create_anbau_partial_figure(df, "SäenDirektStart2", "SäenDirektEnde2", solarised_colors['red'])
-    fig3 = create_anbau_partial_figure(df, "SetzenStart1", "SetzenEnde1", solarised_colors['yellow'])
-    fig4 = create_anbau_partial_figure(df, "SetzenStart2", "SetzenEnde2", solarised_colors['yellow'])
-    fig5 = create_anbau_partial_figure(df, "SteckenStart1", "SteckenEnde1", solarised_colors['blue'])
-    fig6 = create_anbau_partial_figure(df, "ErntefensterStart1", "ErntefensterEnde1", solarised_colors['green'])
-    fig7 = create_anbau_partial_figure(df, "ErntefensterStart2", "ErntefensterEnde2", solarised_colors['green'])
-    combined_figure = go.Figure(data=fig0.data + fig1.data + fig2.data + fig3.data + fig4.data + fig5.data + fig6.data+ fig7.data, layout=fig0.layout)
-    combined_figure.update_layout({
-        'plot_bgcolor': 'rgb(234,216,192)',
-        'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-        'height': height
-        })
-    combined_figure.update_xaxes(range=['2026-01-01', '2026-12-31'], fixedrange=True)
-    combined_figure.update_yaxes(autorange="reversed", fixedrange=True)
-    if grouped:
-        combined_figure.update_layout({'barmode':'group'})
-    return combined_figure
+def connect_execute_history_query(sql_query, params=(), merge=None):
+    # sql_query reads {Plantings} and {SoilImprovements}: the live tables plus
+    # the archived seasons, see archive.py. With more archives than a connection
+    # can attach, the results of the batches are combined by merge(cols, history).
+    cols, history = [], []
+    batches = get_history_queries(sql_query)
+    for archives, batch_query in batches:
+        cols, rows = connect_execute_query(batch_query, params, archives)
+        history += rows
+    if len(batches) > 1 and merge is not None:
+        history = merge(cols, history)
+    return cols, history
 
-def make_anbau_figure_overview(df, height, grouped=True):
-    fig0 = create_anbau_partial_figure_width(df, "SäenVorziehenStart", "SäenVorziehenEnde", solarised_colors['violet'], 1)
-    fig1 = create_anbau_partial_figure_width(df, "SäenDirektStart1", "SäenDirektEnde1", solarised_colors['red'], 0.8)
-    fig2 = create_anbau_partial_figure_width(df, "SäenDirektStart2", "SäenDirektEnde2", solarised_colors['red'], 0.8)
-    fig3 = create_anbau_partial_figure_width(df, "SetzenStart1", "SetzenEnde1", solarised_colors['yellow'], 0.5)
-    fig4 = create_anbau_partial_figure_width(df, "SetzenStart2", "SetzenEnde2", solarised_colors['yellow'], 0.5)
-    fig5 = create_anbau_partial_figure_width(df, "SteckenStart1", "SteckenEnde1", solarised_colors['blue'], 0.4)
-    fig6 = create_anbau_partial_figure_width(df, "ErntefensterStart1", "ErntefensterEnde1", solarised_colors['green'], 0.3)
-    fig7 = create_anbau_partial_figure_width(df, "ErntefensterStart2", "ErntefensterEnde2", solarised_colors['green'], 0.3)
-    combined_figure = go.Figure(data=fig0.data + fig1.data + fig2.data + fig3.data + fig4.data + fig5.data + fig6.data+ fig7.data, layout=fig0.layout)
-    combined_figure.update_layout({
-        'plot_bgcolor': 'rgb(234,216,192)',
-        'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-        'height': height
-        })
-    combined_figure.update_xaxes(range=['2026-01-01', '2026-12-31'], fixedrange=True)
-    combined_figure.update_yaxes(autorange="reversed", fixedrange=True)
-    if grouped:
-        combined_figure.update_layout({'barmode':'group'})
-    return combined_figure
+def get_history_queries(sql_query):
+    # [(archive files, SQL)] of a history query. The archive files only change
+    # with a rollover, which replaces the database as well, so the batches and
+    # the SQL are built once per data version.
+    key = get_data_version()
+    entry = data_cache.get('history_queries')
+    if entry is None or entry['key'] != key:
+        entry = {'key': key, 'batches': archive.history_batches(DATABASE), 'queries': {}}
+        data_cache['history_queries'] = entry
+    queries = entry['queries'].get(sql_query)
+    if queries is None:
+        queries = [(archives, sql_query.format(**tables)) for archives, tables in entry['batches']]
+        entry['queries'][sql_query] = queries
+    return queries
 
-def create_anbau_partial_figure_width(df, start, end, marker_clr, bar_width=1):
+def sort_history(col, descending=False, distinct=False):
+    # Merge like ORDER BY col (and SELECT DISTINCT): NULL first when ascending,
+    # last when descending.
+    def merge(cols, history):
+        if distinct:
+            history = list(dict.fromkeys(history))
+        i = cols.index(col)
+        return sorted(history, key=lambda row: (row[i] is not None, row[i]), reverse=descending)
+    return merge
+
+@server_timing.timed('to_html')
+def anbau_figure_to_html(kultur_name, height):
+    fig_dict = json.loads(get_anbau_figure_json(kultur_name, height, get_data_version()))
+    # The marker for today is the only part that changes from day to day.
+    today = datetime.today().strftime('%Y-%m-%d')
+    fig_dict['layout'].setdefault('shapes', []).append({
+        'type': 'line',
+        'x0': today,
+        'x1': today,
+        'xref': 'x',
+        'y0': 0,
+        'y1': 1,
+        'yref': 'y domain',
+        'line': {'color': 'black', 'width': 3},
+    })
+    return pio.to_html(fig_dict, full_html=False, include_plotlyjs=False, validate=False)
+
+@functools.lru_cache(maxsize=FIGURE_CACHE_SIZE)
+@server_timing.timed('figure')
+def get_anbau_figure_json(kultur_name, height, data_version):
+    # Figure for one crop, or the overview of all crops if kultur_name is None.
+    # Kept on disk as well, so restarted workers don't have to build it again.
+    name_hash = hashlib.sha1(str(kultur_name).encode('utf-8')).hexdigest()
+    path = os.path.join(figure_cache_dir(data_version), f'anbau-{name_hash}-{height}.json')
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+    if kultur_name is None:
+        anbau_cols, anbau_data = get_all_anbau_info()
+    else:
+        anbau_cols, anbau_data = get_anbau_info(kultur_name)
+    df_anbau = pd.DataFrame(anbau_data, columns=anbau_cols)
+    df_anbau = df_anbau.where(df_anbau.notnull(), '')
+    if kultur_name is None:
+        fig = make_anbau_figure_overview(df_anbau, height, grouped=False)
+    else:
+        fig = make_anbau_figure(df_anbau, height)
+    fig_json = fig.to_json()
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(fig_json)
+        os.replace(tmp_path, path)
+    except OSError:
+        # E.g. the directory of an old data version was dropped meanwhile,
+        # the figure is still good for this request.
+        pass
+    return fig_json
+
+def figure_cache_dir(data_version):
+    # Create the directory for this data version and drop those of older
+    # versions, except the previous one: requests and workers that still read
+    # the replaced database keep using it until they see the new version.
+    path = os.path.join(FIGURE_CACHE_DIR, data_version)
+    if not os.path.isdir(path):
+        if os.path.isdir(FIGURE_CACHE_DIR):
+            old_paths = [os.path.join(FIGURE_CACHE_DIR, old_version) for old_version in os.listdir(FIGURE_CACHE_DIR)]
+            # The most recently written directory first.
+            old_paths.sort(key=directory_mtime, reverse=True)
+            for old_path in old_paths[FIGURE_CACHE_VERSIONS - 1:]:
+                shutil.rmtree(old_path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+    return path
+
+def directory_mtime(path):
+    # 0 for directories another worker dropped in the meantime.
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+@server_timing.timed('figure')
+def make_crop_location_figure(df_fig, today):
+    # Where the crop grew: bars per bed and a diamond for every planting date.
     fig = px.timeline(
-        df,
-        x_start=start,
-        x_end=end,
-        y="CropName",
+        df_fig,
+        x_start="StartDate",
+        x_end="EndDate",
+        y="BedID",
+        color="CropFamilie",
+        color_discrete_map = crop_family_colors,
         labels={
-            "CropName": "Kulturnamen"
+            "BedID": "Beet #",
+            "CropFamilie": "Pflanzenfamilien"
         }
     )
-    fig.update_traces(marker_color=marker_clr)
-    for _i, d in enumerate(fig.data):
-        d.width = bar_width
-    return fig
+    fig.update_yaxes(autorange="reversed")
+    fig.update_layout({
+        'plot_bgcolor': 'rgb(234,216,192)',
+        'paper_bgcolor': 'rgba(0, 0, 0, 0)'
+    })
+    fig.update_xaxes(range=[VIZ_START_DATE, today], fixedrange=True)
+    fig.update_yaxes(fixedrange=True)
+    # Points for each starting date
+    dia = px.scatter(
+        df_fig,
+        x="StartDate",
+        y="BedID",
+        color="CropFamilie",
+        color_discrete_map = crop_family_colors,
+        symbol_sequence=['diamond']
+        )
+    dia.update_traces(marker=dict(size=12, line=dict(width=2)))
+    new_fig = go.Figure(data=fig.data + dia.data, layout=fig.layout)
+    # Move legend to top.
+    new_fig.update_layout(legend=dict(
+    orientation="h",
+    yanchor="bottom",
+    y=1.05,
+    xanchor="right",
+    x=1
+    ))
+    return new_fig
 
-def create_anbau_partial_figure(df, start, end, marker_clr):
+@server_timing.timed('figure')
+def make_bed_history_figure(df_fig, today):
+    # What grew in the bed, with the soil improvements below.
     fig = px.timeline(
-        df,
-        x_start=start,
-        x_end=end,
+        df_fig.loc[df_fig['ImprovementName'] == ''],
+        x_start="StartDate",
+        x_end="EndDate",
         y="CropName",
+        color="CropFamilie",
+        color_discrete_map = crop_family_colors,
         labels={
-            "CropName": "Kulturnamen"
+            "CropName": "Kulturnamen",
+            "CropFamilie": "In dem Beet..."
         }
     )
-    fig.update_traces(marker_color=marker_clr)
-    return fig
-
-def daylength(dayOfYear, lat):
-    """Taken from:
-    https://gist.github.com/mluis7/4caeb4edcadcef0e74d0a7c3fde8df5c
-    but really from
-    https://gist.github.com/anttilipp/ed3ab35258c7636d87de6499475301ce
-    but using math instead of nympy.
-    
-    Computes the length of the day (the time between sunrise and
-    sunset) given the day of the year and latitude of the location.
-    Function uses the Brock model for the computations.
-    For more information see, for example,
-    Forsythe et al., "A model comparison for daylength as a
-    function of latitude and day of year", Ecological Modelling,
-    1995.
-    Parameters
-    ----------
-    dayOfYear : int
-        The day of the year. 1 corresponds to 1st of January
-        and 365 to 31st December (on a non-leap year).
-    lat : float
-        Latitude of the location in degrees. Positive values
-        for north and negative for south.
-    Returns
-    -------
-    d : float
-        Daylength in hours.
-    """
-    latInRad = math.radians(lat)
-    declinationOfEarth = 23.45*math.sin(math.radians(360.0*(283.0+dayOfYear)/365.0))
-    if -math.tan(latInRad) * math.tan(math.radians(declinationOfEarth)) <= -1.0:
-        return 24.0
-    elif -math.tan(latInRad) * math.tan(math.radians(declinationOfEarth)) >= 1.0:
-        return 0.0
-    else:
-        hourAngle = math.degrees(math.acos(-math.tan(latInRad) * math.tan(math.radians(declinationOfEarth))))
-        return 2.0*hourAngle/15.0
+    fig.update_yaxes(autorange="reversed")
+    fig.update_layout({
+        'plot_bgcolor': 'rgb(234,216,192)',
+        'paper_bgcolor': 'rgba(0, 0, 0, 0)'
+    })
+    fig.update_xaxes(range=[VIZ_START_DATE, today], fixedrange=True)
+    fig.update_yaxes(fixedrange=True)
+    dia = px.scatter(
+        df_fig.loc[df_fig['ImprovementName'] == ''],
+        x="StartDate",
+        y="CropName",
+        color="CropFamilie",
+        color_discrete_map = crop_family_colors,
+        symbol_sequence=['diamond']
+    )
+    dia.update_traces(marker=dict(size=12, line=dict(width=2)))
+    single_day_events = ['Kompost', 'mit Laub gemulcht']
+    soil_process = px.timeline(
+        # Ignore single day events and empty values when creating bars
+        df_fig.loc[(~df_fig['ImprovementName'].isin(single_day_events) & (df_fig['ImprovementName'] != ''))],
+        x_start="StartDate",
+        x_end="EndDate",
+        y="ImprovementName",
+        color="ImprovementName",
+        color_discrete_map = soil_improvement_colors
+    )
+    # Add "points" to represent single day events
+    soil_event = px.scatter(
+        df_fig.loc[df_fig['ImprovementName'].isin(single_day_events)],
+        x="StartDate",
+        y="ImprovementName",
+        color="ImprovementName",
+        color_discrete_map = soil_improvement_colors,
+        symbol_sequence=['line-ns-open'])
+    soil_event.update_traces(marker=dict(size=12, line=dict(width=10)))
+    # Put it all together!
+    new_fig = go.Figure(data=fig.data + dia.data + soil_process.data + soil_event.data, layout=fig.layout)
+    # Move legend to top.
+    new_fig.update_layout(legend=dict(
+    orientation="h",
+    yanchor="bottom",
+    y=1.05,
+    xanchor="right",
+    x=1
+    ))
+    return new_fig
+
+def make_anbau_figure(df, height, grouped=True):
+    return combine_anbau_figure(make_anbau_traces(df, bar_widths=False), height, grouped)
+
+def make_anbau_figure_overview(df, height, grouped=True):
+    return combine_anbau_figure(make_anbau_traces(df, bar_widths=True), height, grouped)
+
+def combine_anbau_figure(traces, height, grouped):
+    combined_figure = go.Figure(data=traces)
+    combined_figure.update_layout({
+        'plot_bgcolor': 'rgb(234,216,192)',
+        'paper_bgcolor': 'rgba(0, 0, 0, 0)',
+        'height': height,
+        'barmode': 'overlay',
+        'legend': {'tracegroupgap': 0},
+        'margin': {'t': 60},
+        })
+    combined_figure.update_xaxes(anchor='y', domain=[0.0, 1.0], type='date', range=['2026-01-01', '2026-12-31'], fixedrange=True)
+    combined_figure.update_yaxes(anchor='x', domain=[0.0, 1.0], title_text='Kulturnamen', autorange="reversed", fixedrange=True)
+    if grouped:
+        combined_figure.update_layout({'barmode':'group'})
+    return combined_figure
+
+def make_anbau_traces(df, bar_widths=True):
+    # One horizontal bar trace per Anbau window, with the start dates as bar base
+    # and the window length in milliseconds as bar length (as px.timeline does).
+    # All windows are parsed in one go.
+    start_cols = [window[0] for window in ANBAU_WINDOWS]
+    end_cols = [window[1] for window in ANBAU_WINDOWS]
+    shape = (len(df), len(ANBAU_WINDOWS))
+    start_dates = pd.to_datetime(df[start_cols].to_numpy().ravel(), format='%Y-%m-%d', errors='coerce')
+    end_dates = pd.to_datetime(df[end_cols].to_numpy().ravel(), format='%Y-%m-%d', errors='coerce')
+    durations = ((end_dates - start_dates) / pd.Timedelta(milliseconds=1)).to_numpy().reshape(shape)
+    crop_names = df['CropName'].to_numpy()
+    traces = []
+    for i, (start, end, marker_clr, bar_width) in enumerate(ANBAU_WINDOWS):
+        traces.append(go.Bar(
+            base=df[start].to_numpy(),
+            x=durations[:, i],
+            y=crop_names,
+            orientation='h',
+            xaxis='x',
+            yaxis='y',
+            width=bar_width if bar_widths else None,
+            marker={'color': marker_clr, 'pattern': {'shape': ''}},
+            hovertemplate=f'{start}=%{{base}}<br>{end}=%{{x}}<br>Kulturnamen=%{{y}}<extra></extra>',
+            name='',
+            legendgroup='',
+            alignmentgroup='True',
+            offsetgroup='',
+            showlegend=False,
+            textposition='auto',
+        ))
+    return traces
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
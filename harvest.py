@@ -0,0 +1,233 @@
+import functools, math # Standard
+from datetime import datetime
+from lazy_imports import lazy_import # Internal
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+#
+# Harvest status
+#
+# Which open plantings are ready to harvest: days since planting, weighted by
+# the daylength, against the days to maturity of the planting method. The app
+# computes it live, db_stuff stores it as the HarvestStatus table at ingest and
+# in the daily refresh (`python db_init.py --harvest`).
+#
+LAT_SALZBURG = 47.811195
+# Columns of generate_harvest_table and the HarvestStatus table.
+HARVEST_COLUMNS = [
+    'BedID',
+    'StartDate',
+    'CropName',
+    'CropSorte',
+    'PlantingMethod',
+    'TageNachStart',
+    'TageNachStartSonne',
+    'TagezurReife',
+    'TageNachReife',
+    'ErnteStatus',
+]
+HARVEST_ORDER = 'ErnteStatus ASC, TageNachReife DESC, CropName ASC'
+# Shown on the pages: ready to harvest, or no Anbau infos to tell.
+HARVESTABLE_STATUS = ["1: Zum Ernten", "2: Keine Ahnung"]
+UNHARVESTED_QUERY = '''SELECT BedID, StartDate, EndDate, Crops.CropName, CropSorte, CropFamilie, PlantingMethod, Plantings.Notizen
+                    FROM Plantings
+                    INNER JOIN Crops
+                    on Plantings.CropID = Crops.CropID
+                    WHERE Plantings.EndDate IS NULL AND Plantings.ErnteEnde IS NULL
+                    ORDER BY StartDate DESC;'''
+ANBAU_QUERY = '''SELECT *
+                    FROM AnbauInfos;'''
+
+def generate_harvest_table(crop_cols, crop_data, anbau_cols, anbau_data):
+    # Harvest status of the open plantings, from the rows of UNHARVESTED_QUERY
+    # and ANBAU_QUERY.
+    df_harvest = pd.DataFrame(crop_data, columns=crop_cols)
+    df_harvest = df_harvest.where(df_harvest.notnull(), '')
+    # Get harvestable plantings by having no EndDate
+    df_harvest = df_harvest.loc[df_harvest['EndDate'] == '']
+    df_harvest = df_harvest.copy(deep=True)
+
+    # Anbau Info
+    df_anbau = pd.DataFrame(anbau_data, columns=anbau_cols)
+    df_anbau = df_anbau.where(df_anbau.notnull(), '')
+    df_anbau = df_anbau.copy(deep=True)
+
+    # Merge
+    df_harvest = df_harvest.merge(df_anbau, how="inner", on="CropName")
+    desired_columns = [
+            "BedID",
+            "StartDate",
+            "CropName",
+            "CropSorte",
+            "PlantingMethod",
+            "TagezurReifeGesäet",
+            "TagezurReifeGesetzt",
+            "TagezurReifeGesteckt"    ]
+    df_harvest = df_harvest.get(desired_columns)
+
+    # Calculate days from start
+    df_harvest["TageNachStart"] = df_harvest.loc[:, "StartDate"].map(days_from_start)
+    df_harvest["TageNachStartSonne"] = growing_days_sunlight_curve(df_harvest["StartDate"])
+    # Fill nodata to 0.0 numeric typed
+    df_harvest['TagezurReifeGesäet'] = df_harvest['TagezurReifeGesäet'].apply(pd.to_numeric, errors='coerce', downcast='integer').fillna(0)
+    df_harvest['TagezurReifeGesetzt'] = df_harvest['TagezurReifeGesetzt'].apply(pd.to_numeric, errors='coerce', downcast='integer').fillna(0)
+    df_harvest['TagezurReifeGesteckt'] = df_harvest['TagezurReifeGesteckt'].apply(pd.to_numeric, errors='coerce', downcast='integer').fillna(0)
+
+    # Get days to harvest depending on planting method
+    conditions = [
+        df_harvest['PlantingMethod'].eq('gesät'),
+        df_harvest['PlantingMethod'].eq('gesetzt'),
+        df_harvest['PlantingMethod'].eq('gesteckt')
+    ]
+    choices = [
+        df_harvest['TagezurReifeGesäet'],
+        df_harvest['TagezurReifeGesetzt'],
+        df_harvest['TagezurReifeGesteckt'],
+    ]
+    df_harvest['TagezurReife'] = np.select(conditions, choices, default=0)
+    df_harvest = df_harvest.drop(columns=["TagezurReifeGesäet", "TagezurReifeGesetzt", "TagezurReifeGesteckt"])
+    df_harvest['TageNachReife'] = df_harvest['TageNachStartSonne'] - df_harvest['TagezurReife']
+
+    # Calculate whether harvestable
+    conditions = [
+        (df_harvest['TagezurReife'] < 1),
+        (df_harvest['TageNachStartSonne']>= df_harvest['TagezurReife']),
+        (df_harvest['TageNachStartSonne'] < df_harvest['TagezurReife']) & (df_harvest['TagezurReife'] >= 1),
+    ]
+    choices = [
+        "2: Keine Ahnung",
+        "1: Zum Ernten",
+        "3: Reift noch"
+    ]
+    df_harvest['ErnteStatus'] = np.select(conditions, choices, default="2: Keine Ahnung")
+    df_harvest = df_harvest.sort_values(by=['ErnteStatus', "TageNachReife", 'CropName'], ascending=[True, False, True])
+
+    df_harvest = df_harvest.astype({
+    'TageNachStart': 'int',
+    'TageNachStartSonne': 'int',
+    'TagezurReife': 'int',
+    'TageNachReife': 'int',
+    })
+    return df_harvest
+
+#
+# Harvest forecast
+#
+# The date from which the harvest status of an open planting says "Zum Ernten",
+# under the same sunlight-weighted days. For all plantings at once: the day on
+# which the cumulative curve reaches the planting date value plus the days to
+# maturity, found by a binary search in the table of one year.
+#
+FORECAST_COLUMNS = [
+    'Erntewoche',
+    'Erntedatum',
+    'CropName',
+    'CropSorte',
+    'BedID',
+    'StartDate',
+    'PlantingMethod',
+    'TagezurReife',
+]
+
+def generate_harvest_forecast(df_harvest, lat=LAT_SALZBURG):
+    # Projected ripeness date and ISO week of the plantings of a harvest table
+    # that have days to maturity, in the order of the dates.
+    df_forecast = df_harvest.loc[df_harvest['TagezurReife'] >= 1].copy()
+    dates = ripeness_dates(df_forecast['StartDate'], df_forecast['TagezurReife'], lat)
+    # Many plantings share a date, so the labels are formatted once per day.
+    days, day_index = np.unique(dates, return_inverse=True)
+    days = pd.DatetimeIndex(days)
+    weeks = np.array([f'{year}-KW{week:02d}' for year, week, _day in days.isocalendar().itertuples(index=False)], dtype=object)
+    df_forecast['Erntedatum'] = np.asarray(days.strftime('%Y-%m-%d'), dtype=object)[day_index]
+    df_forecast['Erntewoche'] = weeks[day_index]
+    df_forecast = df_forecast.sort_values(by=['Erntedatum', 'CropName', 'BedID'])
+    df_forecast = df_forecast.reset_index(drop=True)
+    return df_forecast[FORECAST_COLUMNS]
+
+def ripeness_dates(planting_dates, days_to_maturity, lat=LAT_SALZBURG):
+    # First day on which round(growing_days_sunlight_curve) reaches the days to
+    # maturity, as datetime64[D].
+    table = sunlight_weight_table(lat)
+    start = pd.to_datetime(planting_dates, format='%Y-%m-%d')
+    target = cumulative_growing_days(start, lat) + np.asarray(days_to_maturity, dtype=float) - 0.5
+    years, remainder = np.divmod(target, table[-1])
+    day_of_year = np.maximum(np.searchsorted(table, remainder, side='left'), 1)
+    year_start = (years.astype(int) + 1 - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+    return year_start + (day_of_year - 1).astype('timedelta64[D]')
+
+#
+# Sunlight curve
+#
+def days_from_start_sunlight_curve(planting_date):
+    growing_days = growing_days_sunlight_curve(pd.Series([planting_date]))
+    return int(growing_days[0])
+
+def growing_days_sunlight_curve(planting_dates, lat=LAT_SALZBURG):
+    # Sunlight-weighted days for all days after planting up to and including today,
+    # taken as the difference of two lookups in the cumulative table.
+    start = pd.to_datetime(planting_dates, format='%Y-%m-%d')
+    days = np.abs((start - datetime.today()).dt.days.to_numpy())
+    end = start + pd.to_timedelta(np.maximum(days - 1, 0), unit='D')
+    growing_days = cumulative_growing_days(end, lat) - cumulative_growing_days(start, lat)
+    return np.round(growing_days).astype(int)
+
+def cumulative_growing_days(dates, lat=LAT_SALZBURG):
+    # Growing days from 0001-01-01 up to and including each date. Every year has the
+    # same weight total, because day 366 always falls in the winter cutoff.
+    table = sunlight_weight_table(lat)
+    dates = pd.DatetimeIndex(dates)
+    return (dates.year.to_numpy() - 1) * table[-1] + table[dates.dayofyear.to_numpy()]
+
+@functools.lru_cache(maxsize=None)
+def sunlight_weight_table(lat):
+    # Cumulative daylength weight per day of the year (index 0 is unused and 0).
+    # No growth counted before day 70 and after day 290, otherwise weighted
+    # by the daylength relative to the longest day.
+    longest_day = daylength(172, lat) # 20 or 21 of June
+    weights = np.zeros(367)
+    for day_of_year in range(71, 290):
+        weights[day_of_year] = daylength(day_of_year, lat) / longest_day
+    return np.cumsum(weights)
+
+def days_from_start(planting_date):
+    days = (datetime.strptime(planting_date, '%Y-%m-%d') - datetime.today()).days
+    days = abs(days)
+    return days
+
+def daylength(dayOfYear, lat):
+    """Taken from:
+    https://gist.github.com/mluis7/4caeb4edcadcef0e74d0a7c3fde8df5c
+    but really from
+    https://gist.github.com/anttilipp/ed3ab35258c7636d87de6499475301ce
+    but using math instead of nympy.
+    
+    Computes the length of the day (the time between sunrise and
+    sunset) given the day of the year and latitude of the location.
+    Function uses the Brock model for the computations.
+    For more information see, for example,
+    Forsythe et al., "A model comparison for daylength as a
+    function of latitude and day of year", Ecological Modelling,
+    1995.
+    Parameters
+    ----------
+    dayOfYear : int
+        The day of the year. 1 corresponds to 1st of January
+        and 365 to 31st December (on a non-leap year).
+    lat : float
+        Latitude of the location in degrees. Positive values
+        for north and negative for south.
+    Returns
+    -------
+    d : float
+        Daylength in hours.
+    """
+    latInRad = math.radians(lat)
+    declinationOfEarth = 23.45*math.sin(math.radians(360.0*(283.0+dayOfYear)/365.0))
+    if -math.tan(latInRad) * math.tan(math.radians(declinationOfEarth)) <= -1.0:
+        return 24.0
+    elif -math.tan(latInRad) * math.tan(math.radians(declinationOfEarth)) >= 1.0:
+        return 0.0
+    else:
+        hourAngle = math.degrees(math.acos(-math.tan(latInRad) * math.tan(math.radians(declinationOfEarth))))
+        return 2.0*hourAngle/15.0
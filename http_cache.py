@@ -0,0 +1,218 @@
+import collections, glob, hashlib, os, threading, zlib # Standard
+from datetime import datetime, time, timezone
+from flask import g, request
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#
+# Conditional requests and compression
+#
+# The pages only change with the database, the date and the code, so every
+# page gets an ETag and a Last-Modified from these and browsers revalidate
+# them (Cache-Control: no-cache). A matching If-None-Match or
+# If-Modified-Since is answered with 304 before the view runs, i.e. without
+# any query or rendering.
+#
+# Responses are compressed with brotli (if the module is installed) or gzip.
+# The compressed pages are kept per ETag, path and encoding, so the next
+# browser asking for the same page gets the bytes without the view running
+# either. Streamed pages are compressed chunk by chunk, with a flush after
+# every chunk so the head still arrives first, and cached once complete.
+#
+# On by default, FARMAPP_HTTP_CACHE=0 (or app.config['HTTP_CACHE'] = False
+# before init_app) turns it off.
+#
+CACHE_MAX_BYTES = 32 * 1024 * 1024 # Compressed pages kept per process
+MIN_COMPRESS_SIZE = 512 # Bytes, smaller responses are sent as they are
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 9 # Whole responses, compressed once and then cached
+BROTLI_STREAM_QUALITY = 5 # Streamed pages, compressed while they are sent
+COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'text/javascript', 'application/javascript', 'application/json', 'image/svg+xml'}
+UNCACHED_ENDPOINTS = {'static', 'metrics'}
+
+cache = collections.OrderedDict() # (ETag, path, accepted encoding) -> (body, mimetype, encoding)
+cache_state = {'bytes': 0}
+cache_lock = threading.Lock()
+
+def enabled_from_env():
+    return os.environ.get('FARMAPP_HTTP_CACHE', '1') not in ('', '0')
+
+def init_app(app, database_path):
+    # database_path() is the path of the database the pages are read from.
+    app.config.setdefault('HTTP_CACHE', enabled_from_env())
+    if not app.config['HTTP_CACHE']:
+        return
+    code_version = get_code_version(app)
+
+    @app.before_request
+    def answer_from_cache():
+        if not is_cacheable_request():
+            return None
+        g.http_encoding = negotiate_encoding()
+        g.http_etag, g.http_last_modified = page_validators(database_path(), code_version, g.http_encoding)
+        if is_not_modified(g.http_etag, g.http_last_modified):
+            response = app.response_class(status=304)
+        else:
+            entry = cache_get((g.http_etag, request.full_path, g.http_encoding))
+            if entry is None:
+                return None
+            body, mimetype, encoding = entry
+            response = app.response_class(body, mimetype=mimetype)
+            set_content_encoding(response, encoding)
+        g.http_cached = True
+        set_validators(response)
+        return response
+
+    @app.after_request
+    def compress_response(response):
+        if g.pop('http_cached', False):
+            return response
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return response
+        if 'http_etag' in g:
+            set_validators(response)
+            compress(response, g.http_encoding, (g.http_etag, request.full_path, g.http_encoding))
+        elif request.endpoint == 'static':
+            # Flask answers the conditional requests of static files itself.
+            encoding = negotiate_encoding()
+            etag, _weak = response.get_etag()
+            if etag is not None and compress(response, encoding, (etag, request.full_path, encoding)):
+                # The same file, just encoded, so the validator stays usable.
+                response.set_etag(etag, weak=True)
+        return response
+
+def get_code_version(app):
+    # Changes when the app or a template is updated.
+    paths = glob.glob(os.path.join(app.root_path, '*.py'))
+    paths += glob.glob(os.path.join(app.root_path, app.template_folder, '*'))
+    stamps = sorted(f'{path}:{os.stat(path).st_mtime_ns}' for path in paths)
+    return hashlib.sha1('\n'.join(stamps).encode('utf-8')).hexdigest()[:12]
+
+def is_cacheable_request():
+    return request.method in ('GET', 'HEAD') and request.endpoint is not None and request.endpoint not in UNCACHED_ENDPOINTS
+
+def negotiate_encoding():
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered, default='identity')
+
+def page_validators(database, code_version, encoding):
+    # ETag per representation, Last-Modified at the latest of the database
+    # change and midnight, when the pages move on by a day.
+    stat = os.stat(database)
+    today = datetime.today().date()
+    version = f'{code_version}-{stat.st_ino}-{stat.st_mtime_ns}-{stat.st_size}-{today}'
+    etag = f'{hashlib.sha1(version.encode("utf-8")).hexdigest()[:20]}-{encoding}'
+    modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc).replace(microsecond=0)
+    midnight = datetime.combine(today, time()).astimezone(timezone.utc)
+    return etag, max(modified, midnight)
+
+def is_not_modified(etag, last_modified):
+    # If-None-Match wins over If-Modified-Since, like in RFC 9110.
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return request.if_modified_since is not None and last_modified <= request.if_modified_since
+
+def set_validators(response):
+    response.set_etag(g.http_etag)
+    response.last_modified = g.http_last_modified
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+
+def set_content_encoding(response, encoding):
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+
+def is_compressible(response):
+    return (response.mimetype in COMPRESSIBLE_TYPES
+        and 'Content-Encoding' not in response.headers
+        and (response.content_length is None or response.content_length >= MIN_COMPRESS_SIZE))
+
+def compress(response, encoding, key):
+    # Compress the response in place and cache it under key. Returns whether
+    # the body was encoded.
+    if not is_compressible(response):
+        encoding = 'identity'
+    if response.is_streamed and not response.direct_passthrough:
+        response.response = compressed_stream(response.response, encoding, key, response.mimetype)
+        response.headers.pop('Content-Length', None)
+        set_content_encoding(response, encoding)
+        return encoding != 'identity'
+    entry = cache_get(key)
+    if entry is None:
+        # Files are read into memory once and then served from the cache.
+        response.direct_passthrough = False
+        body = response.get_data()
+        if len(body) < MIN_COMPRESS_SIZE:
+            encoding = 'identity'
+        entry = (compress_body(body, encoding), response.mimetype, encoding)
+        cache_put(key, entry)
+    body, _mimetype, encoding = entry
+    response.set_data(body)
+    set_content_encoding(response, encoding)
+    return encoding != 'identity'
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+    return body
+
+def stream_compressor(encoding):
+    # (compress, finish): compress(data) returns what can be sent right away.
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_STREAM_QUALITY)
+        return lambda data: compressor.process(data) + compressor.flush(), compressor.finish
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    return lambda data: data, lambda: b''
+
+def compressed_stream(chunks, encoding, key, mimetype):
+    compress_chunk, finish = stream_compressor(encoding)
+    sent = []
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress_chunk(chunk)
+            if data:
+                sent.append(data)
+                yield data
+        data = finish()
+        sent.append(data)
+        yield data
+        # Only complete pages end up in the cache, not aborted downloads.
+        cache_put(key, (b''.join(sent), mimetype, encoding))
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def cache_get(key):
+    with cache_lock:
+        entry = cache.get(key)
+        if entry is not None:
+            cache.move_to_end(key)
+        return entry
+
+def cache_put(key, entry):
+    size = len(entry[0])
+    if size > CACHE_MAX_BYTES // 4:
+        return
+    with cache_lock:
+        if key in cache:
+            return
+        cache[key] = entry
+        cache_state['bytes'] += size
+        while cache_state['bytes'] > CACHE_MAX_BYTES:
+            _key, (body, _mimetype, _encoding) = cache.popitem(last=False)
+            cache_state['bytes'] -= len(body)
+
+def clear_cache():
+    with cache_lock:
+        cache.clear()
+        cache_state['bytes'] = 0
@@ -0,0 +1,20 @@
+import importlib.util, sys # Standard
+
+#
+# Lazy imports
+#
+# pandas, numpy and plotly take about a second to import. Modules imported
+# through lazy_import are loaded on the first attribute access instead, so a
+# recycled worker answers the landing page (which needs none of them) right
+# away. farmapp.warm_up() loads them ahead of the first request.
+#
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,98 @@
+import re, sys # Standard
+import archive, db_pool, farmapp # Internal
+
+#
+# EXPLAIN QUERY PLAN check for the queries behind the routes.
+#
+# Run with `python query_plan_check.py` against the current, ingested database;
+# tests/test_query_plans.py runs the same check on a fresh ingest.
+# Every query has to find its rows through an index; only the queries that
+# read a whole table on purpose may scan it. The history queries also read
+# the archived seasons when there are any (see archive.py).
+#
+FULL_TABLE_QUERIES = [
+    'get_all_anbau_info',
+    'get_all_planted_crops',
+    'get_all_active_beds',
+    'get_most_recent_update_date',
+    'search_crops', # Only scans its materialized FTS matches
+]
+# Derived tables of the ingest (db_stuff.insert_data), which the routes query.
+INGESTED_TABLES = ['Metadata', 'HarvestStatus', 'CropSearch']
+
+def route_queries():
+    crop_name = farmapp.get_all_planted_crops()[0]
+    family = list(farmapp.crop_family_colors.keys())[0]
+    return [
+        ('get_planting_history_per_bed', lambda: farmapp.get_planting_history_per_bed(5)),
+        ('get_planting_history_per_family', lambda: farmapp.get_planting_history_per_family(family)),
+        ('get_beds_per_family_and_year', lambda: farmapp.get_beds_per_family_and_year(list(farmapp.crop_family_colors.keys()))),
+        ('get_soil_history', lambda: farmapp.get_soil_history(5)),
+        ('get_anbau_info', lambda: farmapp.get_anbau_info(crop_name)),
+        ('get_all_anbau_info', farmapp.get_all_anbau_info),
+        ('get_specific_crop', lambda: farmapp.get_specific_crop(crop_name)),
+        ('get_all_unharvested_crops', farmapp.get_all_unharvested_crops),
+        ('get_all_planted_crops', farmapp.get_all_planted_crops),
+        ('get_all_active_beds', farmapp.get_all_active_beds),
+        ('get_most_recent_update_date', farmapp.get_most_recent_update_date),
+        ('get_all_folien', farmapp.get_all_folien),
+        ('query_harvestable per bed', lambda: farmapp.query_harvestable('BedID = ?', (5,))),
+        ('query_harvestable per crop', lambda: farmapp.query_harvestable('CropName = ?', (crop_name,))),
+        ('query_harvestable', farmapp.query_harvestable),
+        ('search_crops', lambda: farmapp.search_crops(crop_name[:3])),
+        ('resolve_crop_name', lambda: farmapp.resolve_crop_name(crop_name)),
+    ]
+
+def missing_tables():
+    with db_pool.pooled_connection(farmapp.DATABASE) as conn:
+        table_names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return [name for name in INGESTED_TABLES if name not in table_names]
+
+def record_queries(func):
+    # Collect the SQL and parameters that func sends to the database. Queries
+    # that fail, e.g. a probe for a table the database doesn't have, are left out.
+    recorded = []
+    execute_query = farmapp.connect_execute_query
+    def recording_execute_query(sql_query, params=(), archives=()):
+        result = execute_query(sql_query, params, archives)
+        recorded.append((sql_query, params, archives))
+        return result
+    farmapp.connect_execute_query = recording_execute_query
+    try:
+        func()
+    finally:
+        farmapp.connect_execute_query = execute_query
+    return recorded
+
+def explain(sql_query, params, archives=()):
+    with db_pool.pooled_connection(farmapp.DATABASE) as conn:
+        archive.attach(conn, archives)
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {sql_query}', params).fetchall()
+    return [row[-1] for row in plan]
+
+def check_query_plans():
+    failed = []
+    for name, func in route_queries():
+        for sql_query, params, archives in record_queries(func):
+            plan = explain(sql_query, params, archives)
+            # A plain "SCAN <table>" reads the table without any index.
+            scans = [step for step in plan if re.fullmatch(r'SCAN \w+', step)]
+            status = 'ok'
+            if scans and name not in FULL_TABLE_QUERIES:
+                status = 'FULL SCAN'
+                failed.append(name)
+            print(f'{name}: {status}')
+            for step in plan:
+                print(f'    {step}')
+    return failed
+
+if __name__ == "__main__":
+    missing = missing_tables()
+    if len(missing) != 0:
+        # The indexes come with the ingest as well.
+        print('{} lacks the tables of the ingest ({}), build it with `python db_init.py` first.'.format(farmapp.DATABASE, ', '.join(missing)))
+        sys.exit(1)
+    failed = check_query_plans()
+    if len(failed) != 0:
+        print('Queries without index: {}'.format(', '.join(failed)))
+        sys.exit(1)
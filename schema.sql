@@ -72,4 +72,61 @@ CREATE TABLE IF NOT EXISTS AnbauInfos (
     ErntefensterStart2 DATE,
     ErntefensterEnde2 DATE,
     Notizen VARCHAR(255)
-);
\ No newline at end of file
+);
+
+-- Values derived at ingest time, e.g. LastUpdate.
+CREATE TABLE IF NOT EXISTS Metadata (
+    MetaKey VARCHAR(255) PRIMARY KEY,
+    MetaValue VARCHAR(255)
+);
+
+-- Hash of every sheet row at the last ingest, for incremental syncs.
+CREATE TABLE IF NOT EXISTS SyncHashes (
+    SheetName VARCHAR(255),
+    RowID INT,
+    RowHash INT,
+    PRIMARY KEY (SheetName, RowID)
+);
+
+-- Harvest status of the open plantings (see harvest.py), written at ingest and
+-- by the daily refresh. Metadata HarvestDate is the day it was computed for.
+CREATE TABLE IF NOT EXISTS HarvestStatus (
+    BedID INT,
+    StartDate DATE,
+    CropName VARCHAR(255),
+    CropSorte VARCHAR(255),
+    PlantingMethod VARCHAR(255),
+    TageNachStart INT,
+    TageNachStartSonne INT,
+    TagezurReife INT,
+    TageNachReife INT,
+    ErnteStatus VARCHAR(255)
+);
+
+-- Full text index of the crop names for the crop search, written at ingest
+-- (see crop_search.py). One row per crop and variety.
+CREATE VIRTUAL TABLE IF NOT EXISTS CropSearch USING fts5(
+    CropName,
+    AlternativeNamen,
+    CropSorte,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+--
+-- Indexes for the lookups of the flask app.
+--
+CREATE INDEX IF NOT EXISTS Plantings_BedID_idx ON Plantings (BedID, StartDate);
+CREATE INDEX IF NOT EXISTS Plantings_CropID_idx ON Plantings (CropID, StartDate);
+-- Open plantings, i.e. everything that could still be harvested.
+CREATE INDEX IF NOT EXISTS Plantings_Open_idx ON Plantings (StartDate, CropID, BedID)
+    WHERE EndDate IS NULL AND ErnteEnde IS NULL;
+CREATE INDEX IF NOT EXISTS SoilImprovements_BedID_idx ON SoilImprovements (BedID, StartDate);
+CREATE INDEX IF NOT EXISTS SoilImprovements_ImprovementName_idx ON SoilImprovements (ImprovementName, StartDate);
+CREATE INDEX IF NOT EXISTS Crops_CropFamilie_idx ON Crops (CropFamilie, CropID);
+-- Case insensitive crop lookups use LOWER(CropName).
+CREATE INDEX IF NOT EXISTS Crops_LowerCropName_idx ON Crops (LOWER(CropName));
+CREATE INDEX IF NOT EXISTS AnbauInfos_LowerCropName_idx ON AnbauInfos (LOWER(CropName));
+CREATE INDEX IF NOT EXISTS HarvestStatus_BedID_idx ON HarvestStatus (BedID);
+CREATE INDEX IF NOT EXISTS HarvestStatus_CropName_idx ON HarvestStatus (CropName);
+CREATE INDEX IF NOT EXISTS HarvestStatus_ErnteStatus_idx ON HarvestStatus (ErnteStatus, TageNachReife);
@@ -0,0 +1,79 @@
+import argparse, gc, os, sys, time # Standard
+from gunicorn.app.base import BaseApplication
+import db_pool, farmapp # Internal
+
+#
+# Preforked server
+#
+# Runs the app with gunicorn in several worker processes on one port, for
+# production without the flask development server:
+#
+#   python serve.py --port 8000 --workers 4 --threads 4
+#
+# The app is preloaded in the gunicorn master: it imports pandas and plotly
+# and fills the caches (harvest table, daylength table, Anbau figures,
+# optionally the data snapshot) once, then gunicorn forks the workers. They
+# share that memory copy-on-write instead of every worker building it again.
+# gc.freeze() keeps the garbage collector from touching, and thereby copying,
+# the inherited objects.
+#
+# The workers are gthread workers with --threads threads each, so every one
+# answers that many requests at the same time. gunicorn replaces workers that
+# exit or hang for longer than TIMEOUT. POSIX only (gunicorn forks).
+#
+TIMEOUT = 60 # Seconds a worker may be busy with one request before it is replaced
+GRACEFUL_TIMEOUT = 30 # Seconds the workers get to finish their requests on shutdown
+BACKLOG = 128 # Connections waiting to be accepted
+
+class Application(BaseApplication):
+    # gunicorn with the settings of the command line instead of its own.
+    def __init__(self, options, figures=False):
+        self.options = options
+        self.figures = figures
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Runs once in the master, because of preload_app.
+        start_time = time.perf_counter()
+        farmapp.warm_up(figures=self.figures)
+        print('Warm-up done in {:.1f} s'.format(time.perf_counter() - start_time))
+        return farmapp.app
+
+def when_ready(server):
+    # The master is about to fork the first workers.
+    # SQLite connections must not be shared with the forked workers.
+    db_pool.close_all()
+    gc.freeze()
+
+def serve(host, port, workers, threads, figures=False):
+    options = {
+        'bind': '[{}]:{}'.format(host, port) if ':' in host else '{}:{}'.format(host, port),
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': threads,
+        'preload_app': True,
+        'when_ready': when_ready,
+        'timeout': TIMEOUT,
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'backlog': BACKLOG,
+        'accesslog': '-',
+    }
+    Application(options, figures=figures).run()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve the app with preforked gunicorn worker processes.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on, 0.0.0.0 for all.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes, defaults to the number of CPUs.')
+    parser.add_argument('--threads', type=int, default=4, help='Requests each worker handles at the same time.')
+    parser.add_argument('--figures', action='store_true', help='Build the Anbau figure of every crop before forking.')
+    parser.add_argument('--snapshot', action='store_true', help='Answer the queries from the in-memory snapshot, see snapshot.py.')
+    args = parser.parse_args()
+    if args.snapshot:
+        farmapp.app.config['DATA_SNAPSHOT'] = True
+    serve(args.host, args.port, args.workers, args.threads, args.figures)
+    sys.exit()
@@ -0,0 +1,114 @@
+import collections, contextlib, functools, os, threading, time # Standard
+from flask import g, has_request_context, jsonify, request, template_rendered, before_render_template
+
+#
+# Per-request phase timing
+#
+# Opt-in with FARMAPP_SERVER_TIMING=1 (or app.config['SERVER_TIMING'] = True
+# before init_app). Every response then gets a Server-Timing header with the
+# time spent per phase (sql, harvest, figure, to_html, jinja), the number of
+# calls per phase and the response size, e.g. in the network tab of the
+# browser. The last HISTORY_SIZE requests per route are kept in memory and
+# summarised at /metrics.
+#
+# Phases may be nested (the harvest table runs sql queries), so their sum can
+# be larger than the total.
+#
+HISTORY_SIZE = 500 # Requests kept per route
+PERCENTILES = [50, 90, 99]
+
+history = collections.defaultdict(lambda: collections.deque(maxlen=HISTORY_SIZE))
+history_lock = threading.Lock()
+
+def enabled_from_env():
+    return os.environ.get('FARMAPP_SERVER_TIMING', '') not in ('', '0')
+
+@contextlib.contextmanager
+def phase(name):
+    # Only active within an instrumented request, otherwise a no-op.
+    if not has_request_context() or 'phases' not in g:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration, count = g.phases.get(name, (0.0, 0))
+        g.phases[name] = (duration + time.perf_counter() - start, count + 1)
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def init_app(app):
+    app.config.setdefault('SERVER_TIMING', enabled_from_env())
+    if not app.config['SERVER_TIMING']:
+        return
+
+    @app.before_request
+    def start_timing():
+        g.phases = {}
+        g.request_start = time.perf_counter()
+
+    @before_render_template.connect_via(app, weak=False)
+    def start_template(sender, template, context, **extra):
+        if 'phases' in g:
+            g.template_start = time.perf_counter()
+
+    @template_rendered.connect_via(app, weak=False)
+    def stop_template(sender, template, context, **extra):
+        if 'template_start' in g:
+            duration, count = g.phases.get('jinja', (0.0, 0))
+            g.phases['jinja'] = (duration + time.perf_counter() - g.pop('template_start'), count + 1)
+
+    @app.after_request
+    def add_server_timing(response):
+        if 'phases' not in g or request.endpoint == 'metrics':
+            return response
+        total = time.perf_counter() - g.request_start
+        # Streamed responses have no size yet.
+        size = response.content_length
+        metrics = [f'{name};dur={duration * 1000:.2f};desc="{count}x"' for name, (duration, count) in g.phases.items()]
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        if size is not None:
+            metrics.append(f'size;desc="{size} B"')
+        response.headers.add('Server-Timing', ', '.join(metrics))
+        # Group by route pattern, so all /beetID/<ID> pages end up together.
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        sample = {name: duration for name, (duration, count) in g.phases.items()}
+        sample['total'] = total
+        sample['queries'] = g.phases.get('sql', (0.0, 0))[1]
+        sample['size'] = size or 0
+        with history_lock:
+            history[route].append(sample)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return jsonify(summarise_history())
+
+def summarise_history():
+    # Count, mean and percentiles per route and phase, times in milliseconds.
+    import numpy as np
+    with history_lock:
+        samples_per_route = {route: list(samples) for route, samples in history.items()}
+    summary = {}
+    for route, samples in samples_per_route.items():
+        names = sorted({name for sample in samples for name in sample})
+        route_summary = {'requests': len(samples)}
+        for name in names:
+            values = np.array([sample.get(name, 0) for sample in samples], dtype=float)
+            if name not in ('queries', 'size'):
+                values = values * 1000
+            route_summary[name] = {
+                'mean': round(float(values.mean()), 2),
+                **{f'p{p}': round(float(np.percentile(values, p)), 2) for p in PERCENTILES},
+                'max': round(float(values.max()), 2),
+            }
+        summary[route] = route_summary
+    return summary
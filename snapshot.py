@@ -0,0 +1,278 @@
+import os, threading # Standard
+import archive, db_pool, harvest # Internal
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+#
+# In-memory snapshot of the database
+#
+# Optional data engine for the app (FARMAPP_SNAPSHOT=1). The tables are read
+# once into columns of categorical codes (with datetime64 categories for the
+# dates), with Plantings already joined to Crops, and every
+# lookup of the get_* functions in farmapp.py gets a prebuilt row index (per
+# bed, per crop, per family, ...). The functions here return the same
+# (cols, rows) as the SQL queries, so the routes don't notice the difference.
+# A new data version (the file was rewritten or replaced) loads a new snapshot.
+# The archived seasons are part of it, for the history lookups.
+#
+TABLES = ['Crops', 'Plantings', 'SoilImprovements', 'AnbauInfos'] # Beds is not read by the app
+CROP_COLUMNS = ['CropName', 'AlternativeNamen', 'CropSorte', 'CropFamilie']
+PLANTING_COLUMNS = ['BedID', 'StartDate', 'EndDate', 'ErnteEnde', 'PlantingMethod', 'Quelle', 'Notizen']
+# Dates as datetime64[D] categories, if all their values are ISO dates.
+DATE_COLUMNS = ['StartDate', 'EndDate', 'ErnteEnde']
+# Column lists of the SQL queries in farmapp.py.
+BED_HISTORY_COLUMNS = ['StartDate', 'EndDate', 'CropName', 'AlternativeNamen', 'CropSorte', 'CropFamilie', 'PlantingMethod', 'Quelle', 'Notizen']
+FAMILY_HISTORY_COLUMNS = ['BedID', 'StartDate', 'EndDate', 'CropName', 'AlternativeNamen', 'CropSorte', 'CropFamilie', 'PlantingMethod', 'Notizen']
+CROP_HISTORY_COLUMNS = ['BedID', 'StartDate', 'EndDate', 'CropName', 'CropSorte', 'CropFamilie', 'PlantingMethod', 'Quelle', 'Notizen']
+UNHARVESTED_COLUMNS = ['BedID', 'StartDate', 'EndDate', 'CropName', 'CropSorte', 'CropFamilie', 'PlantingMethod', 'Notizen']
+SOIL_COLUMNS = ['StartDate', 'EndDate', 'ImprovementName', 'Notizen']
+FOLIEN_COLUMNS = ['BedID', 'StartDate', 'EndDate', 'Notizen']
+# SQLite's LOWER() only folds ASCII letters.
+ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+snapshots = {}
+snapshots_lock = threading.Lock()
+
+def enabled_from_env():
+    return os.environ.get('FARMAPP_SNAPSHOT', '') not in ('', '0')
+
+def get_snapshot(database, data_version):
+    snap = snapshots.get(database)
+    if snap is None or snap['version'] != data_version:
+        with snapshots_lock:
+            snap = snapshots.get(database)
+            if snap is None or snap['version'] != data_version:
+                snap = load_snapshot(database, data_version)
+                snapshots[database] = snap
+    return snap
+
+#
+# Loading
+#
+def load_snapshot(database, data_version):
+    with db_pool.pooled_connection(database) as conn:
+        # One read transaction, so all tables are from the same state of the file.
+        conn.execute('BEGIN')
+        try:
+            table_names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            tables = {name: read_table(conn, f'SELECT * FROM {name}') for name in TABLES}
+            metadata = {}
+            if 'Metadata' in table_names:
+                metadata = dict(conn.execute('SELECT MetaKey, MetaValue FROM Metadata').fetchall())
+            harvest_status = (harvest.HARVEST_COLUMNS, [])
+            if 'HarvestStatus' in table_names:
+                harvest_status = read_rows(conn, f'''SELECT {', '.join(harvest.HARVEST_COLUMNS)}
+                    FROM HarvestStatus
+                    ORDER BY {harvest.HARVEST_ORDER}''')
+        finally:
+            conn.rollback()
+    # The live rows come first, then the archives like in the history queries.
+    live_tables = dict(tables)
+    for path in archive.archive_paths(database):
+        with db_pool.pooled_connection(path) as conn:
+            for name in archive.ARCHIVED_TABLES:
+                tables[name] = concat_tables(tables[name], read_table(conn, f'SELECT * FROM {name}'))
+    tables = {name: typed_table(table) for name, table in tables.items()}
+    plantings = join_crops(tables['Plantings'], tables['Crops'])
+    soil = tables['SoilImprovements']
+    anbau = tables['AnbauInfos']
+    # Without the join, like the SQL for these two.
+    all_plantings = tables['Plantings']
+    update_dates = [date for name in archive.ARCHIVED_TABLES for col in ('StartDate', 'EndDate')
+        for date in live_tables[name][col] if date is not None]
+    planting_start_desc = order_desc(plantings['StartDate'])
+    soil_start_desc = order_desc(soil['StartDate'])
+    # The Folien view only reads the live database.
+    live_soil_start_desc = soil_start_desc[soil_start_desc < len(live_tables['SoilImprovements']['BedID'])]
+    open_plantings = planting_start_desc[is_null(plantings['EndDate'])[planting_start_desc]
+        & is_null(plantings['ErnteEnde'])[planting_start_desc]]
+    return {
+        'version': data_version,
+        'plantings': plantings,
+        'soil': soil,
+        'anbau': anbau,
+        # (codes, values as SQLite returns them) per column, to answer the queries.
+        # The codes as intp, numpy would convert the small codes on every lookup.
+        'values': {name: {col: (column.codes.astype(np.intp), column_labels(column)) for col, column in table.items()}
+            for name, table in (('plantings', plantings), ('soil', soil), ('anbau', anbau))},
+        'metadata': metadata,
+        'update_date': metadata.get('LastUpdate', max(update_dates, default=None)),
+        'harvest_status': harvest_status,
+        'plantings_per_bed': row_index(plantings['BedID'], planting_start_desc),
+        'plantings_per_crop': row_index(sqlite_lower(plantings['CropName']), planting_start_desc),
+        'plantings_per_family': row_index(plantings['CropFamilie'], order_asc(plantings['BedID'])),
+        'soil_per_bed': row_index(soil['BedID'], order_asc(soil['StartDate'])),
+        'soil_per_name': row_index(soil['ImprovementName'], live_soil_start_desc),
+        'anbau_per_crop': row_index(sqlite_lower(anbau['CropName']), np.arange(len(anbau['CropName']))),
+        'open_plantings': open_plantings,
+        'beds_per_family_and_year': group_beds_per_family_and_year(plantings),
+        'planted_crops': sorted_distinct(column_values(plantings['CropName'])),
+        'active_beds': sorted_distinct(np.concatenate([
+            column_values(all_plantings['BedID'][is_null(all_plantings['EndDate'])]),
+            column_values(soil['BedID'][is_null(soil['EndDate'])]),
+        ]), drop_null=True),
+    }
+
+def read_rows(conn, sql_query):
+    cur = conn.execute(sql_query)
+    return [col[0] for col in cur.description], cur.fetchall()
+
+def read_table(conn, sql_query):
+    # Column name -> object array of the values as SQLite returns them.
+    cols, rows = read_rows(conn, sql_query)
+    data = np.empty((len(rows), len(cols)), dtype=object)
+    if len(rows) != 0:
+        data[:] = rows
+    return {col: data[:, i] for i, col in enumerate(cols)}
+
+def concat_tables(table, other):
+    return {col: np.concatenate([table[col], other[col]]) for col in table}
+
+def typed_table(table):
+    return {col: typed_column(col, values) for col, values in table.items()}
+
+def typed_column(col, values):
+    # Categorical of an object array; the categories are datetime64 for the
+    # dates and of the type of the values (int, str) otherwise.
+    if col in DATE_COLUMNS:
+        dates = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce')
+        not_null = ~is_null(values)
+        # Only if every value comes back unchanged, e.g. no times or typos.
+        if (np.asarray(dates.strftime('%Y-%m-%d'), dtype=object)[not_null] == values[not_null]).all():
+            return pd.Categorical(dates.values.astype('datetime64[D]'))
+    return pd.Categorical(values)
+
+def column_labels(column):
+    # The categories as SQLite returns them, with None last for code -1 (NULL).
+    categories = column.categories
+    if isinstance(categories, pd.DatetimeIndex):
+        categories = categories.strftime('%Y-%m-%d')
+    return np.array(categories.tolist() + [None], dtype=object)
+
+def column_values(column):
+    # Object array of the values as SQLite returns them.
+    return column_labels(column)[column.codes]
+
+def join_crops(plantings, crops):
+    # Plantings INNER JOIN Crops on CropID, with the crop columns on every row.
+    crop_rows = pd.Index(column_values(crops['CropID'])).get_indexer(column_values(plantings['CropID']))
+    matched = np.flatnonzero(crop_rows >= 0)
+    joined = {col: plantings[col][matched] for col in PLANTING_COLUMNS}
+    for col in CROP_COLUMNS:
+        joined[col] = crops[col][crop_rows[matched]]
+    return joined
+
+def is_null(values):
+    return pd.isnull(values)
+
+def sort_key(values):
+    # Categorical codes in value order; NULL gets -1 and sorts first, as in SQLite.
+    codes, _uniques = pd.factorize(values, sort=True)
+    return codes
+
+def order_asc(values):
+    return np.argsort(sort_key(values), kind='stable')
+
+def order_desc(values):
+    # Descending with NULL last, ties in table order.
+    return np.argsort(-sort_key(values), kind='stable')
+
+def sqlite_lower(column):
+    # Lowered once per category, not per row.
+    labels = [value.translate(ASCII_LOWER) if isinstance(value, str) else value for value in column_labels(column)]
+    return np.array(labels, dtype=object)[column.codes]
+
+def row_index(keys, order):
+    # Key -> row numbers in the given order, for WHERE col = ? (NULL never matches).
+    codes, uniques = pd.factorize(keys[order])
+    positions = pd.Series(codes).groupby(codes, sort=False).indices
+    return {uniques[code]: order[rows] for code, rows in positions.items() if code != -1}
+
+def sorted_distinct(values, drop_null=False):
+    nulls = [None] if is_null(values).any() and not drop_null else []
+    return nulls + sorted(set(values[~is_null(values)].tolist()))
+
+def group_beds_per_family_and_year(plantings):
+    # Family -> rows of (CropFamilie, Jahr, beds joined by commas, number of beds).
+    df = pd.DataFrame({
+        'CropFamilie': column_values(plantings['CropFamilie']),
+        'Jahr': pd.Series(column_values(plantings['StartDate']), dtype=object).str.slice(0, 4),
+        'BedID': column_values(plantings['BedID']),
+    }).dropna().drop_duplicates()
+    grouped = {}
+    for (family, year), beds in df.groupby(['CropFamilie', 'Jahr'], sort=True)['BedID']:
+        grouped.setdefault(family, []).append((family, year, ','.join(str(bed) for bed in beds), len(beds)))
+    return grouped
+
+#
+# Queries, answered like the SQL in farmapp.py
+#
+def bed_key(bid):
+    # Bound parameters compare to BedID with numeric affinity, so '5' finds bed 5.
+    try:
+        value = float(bid)
+    except (TypeError, ValueError):
+        return bid
+    return int(value) if value.is_integer() else value
+
+def select(snap, name, cols, rows):
+    values = snap['values'][name]
+    return cols, list(zip(*(labels[codes[rows]].tolist() for codes, labels in map(values.get, cols))))
+
+def no_rows():
+    return np.array([], dtype=int)
+
+def planting_history_per_bed(snap, bid):
+    rows = snap['plantings_per_bed'].get(bed_key(bid), no_rows())
+    return select(snap, 'plantings', BED_HISTORY_COLUMNS, rows)
+
+def planting_history_per_family(snap, family):
+    rows = snap['plantings_per_family'].get(family, no_rows())
+    return select(snap, 'plantings', FAMILY_HISTORY_COLUMNS, rows)
+
+def beds_per_family_and_year(snap, family_list):
+    history = []
+    for family in sorted(set(family_list)):
+        history += snap['beds_per_family_and_year'].get(family, [])
+    return ['CropFamilie', 'Jahr', 'GROUP_CONCAT(BedID)', 'COUNT(BedID)'], history
+
+def soil_history(snap, bid):
+    rows = snap['soil_per_bed'].get(bed_key(bid), no_rows())
+    return select(snap, 'soil', SOIL_COLUMNS, rows)
+
+def anbau_info(snap, crop_str):
+    rows = snap['anbau_per_crop'].get(str(crop_str).lower(), no_rows())
+    return select(snap, 'anbau', list(snap['anbau']), rows)
+
+def all_anbau_info(snap):
+    anbau = snap['anbau']
+    return select(snap, 'anbau', list(anbau), np.arange(len(anbau['CropName'])))
+
+def specific_crop(snap, crop_str):
+    rows = snap['plantings_per_crop'].get(str(crop_str).lower(), no_rows())
+    return select(snap, 'plantings', CROP_HISTORY_COLUMNS, rows)
+
+def all_unharvested_crops(snap):
+    return select(snap, 'plantings', UNHARVESTED_COLUMNS, snap['open_plantings'])
+
+def all_planted_crops(snap):
+    return list(snap['planted_crops'])
+
+def all_active_beds(snap):
+    return list(snap['active_beds'])
+
+def all_folien(snap):
+    rows = snap['soil_per_name'].get('Schwarze Folie', no_rows())
+    return select(snap, 'soil', FOLIEN_COLUMNS, rows)
+
+def most_recent_update_date(snap):
+    return snap['update_date']
+
+def metadata_value(snap, key):
+    return snap['metadata'].get(key)
+
+def harvest_status(snap):
+    cols, history = snap['harvest_status']
+    return cols, history
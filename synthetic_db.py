@@ -0,0 +1,88 @@
+import argparse, os, sqlite3 # Standard
+import pandas as pd
+import crop_search # Internal
+
+#
+# Synthetic databases for benchmarks
+#
+# Scales the bundled database up by copying its rows. Every copy of the
+# plantings and soil improvements is moved back by some years on the same beds
+# and crops, as if the history had grown season after season. Every copy of the
+# crop catalogue (Beds, Crops, AnbauInfos) gets new names, so lists and search
+# grow as well. Only the most recent copy keeps open plantings.
+#
+#   python synthetic_db.py --scale 100 --out bench_data/erdling_x100.db
+#
+TEMPLATE_DATABASE = 'erdling.db'
+SCHEMA = 'schema.sql'
+MAX_HISTORY_YEARS = 50 # Older copies fold back into these years
+SHEETS = ['Beds', 'Crops', 'AnbauInfos', 'Plantings', 'SoilImprovements']
+DATE_COLS = {
+    'Plantings': ['StartDate', 'ErnteEnde', 'SamenErnte', 'EndDate'],
+    'SoilImprovements': ['StartDate', 'EndDate'],
+}
+NAME_COLS = {
+    'Beds': 'BedLabel',
+    'Crops': 'CropName',
+    'AnbauInfos': 'CropName',
+}
+
+def read_template(template=TEMPLATE_DATABASE):
+    conn = sqlite3.connect(template)
+    tables = {sheet: pd.read_sql_query(f'SELECT * FROM {sheet}', conn) for sheet in SHEETS}
+    conn.close()
+    return tables
+
+def shift_years(dates, years):
+    # On the date strings, so years outside of the pandas range are no problem.
+    dates = dates.astype(object)
+    valid = dates.notnull()
+    shifted = dates[valid].str.slice(0, 4).astype(int) - years
+    dates[valid] = shifted.astype(str).str.zfill(4) + dates[valid].str.slice(4).str.replace('-02-29', '-02-28')
+    return dates
+
+def scale_table(sheet, df, scale):
+    id_col = df.columns[0]
+    copies = []
+    for copy in range(scale):
+        df_copy = df.copy()
+        df_copy[id_col] = df[id_col] + copy * (df[id_col].max() + 1)
+        if sheet in NAME_COLS and copy > 0:
+            df_copy[NAME_COLS[sheet]] = df[NAME_COLS[sheet]] + f' {copy}'
+        if sheet in DATE_COLS and copy > 0:
+            for col in DATE_COLS[sheet]:
+                df_copy[col] = shift_years(df[col], copy % MAX_HISTORY_YEARS + 1)
+            # Only the current season has open plantings and tarps.
+            df_copy['EndDate'] = df_copy['EndDate'].fillna(df_copy['StartDate'])
+        copies.append(df_copy)
+    return pd.concat(copies, ignore_index=True)
+
+def generate_database(path, scale, template=TEMPLATE_DATABASE):
+    tables = read_template(template)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = MEMORY')
+    conn.execute('PRAGMA synchronous = OFF')
+    with open(SCHEMA, mode='r') as f:
+        conn.executescript(f.read())
+    with conn:
+        for sheet in SHEETS:
+            df = scale_table(sheet, tables[sheet], scale)
+            df = df.astype(object).where(df.notnull(), None)
+            columns_str = ', '.join(df.columns)
+            placeholders = ', '.join(['?'] * len(df.columns))
+            conn.executemany(f'INSERT INTO {sheet} ({columns_str}) VALUES ({placeholders})',
+                df.itertuples(index=False, name=None))
+        crop_search.write_index(conn)
+    conn.execute('ANALYZE')
+    conn.close()
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a scaled up copy of the database.')
+    parser.add_argument('--scale', type=int, default=10, help='Number of copies of every table.')
+    parser.add_argument('--out', required=True, help='Path of the generated database.')
+    args = parser.parse_args()
+    generate_database(args.out, args.scale)
+    print('Synthetic database x{} saved to: {}'.format(args.scale, args.out))
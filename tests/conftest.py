@@ -0,0 +1,65 @@
+import os, shutil, sqlite3, sys, types # Standard
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# schema.sql, the templates and the static files are found relative to the repository.
+os.chdir(ROOT)
+SHEETS = ['AnbauInfos', 'Beds', 'Crops', 'Plantings', 'SoilImprovements']
+
+# config_farmapp reads the sheet IDs from secret_farmapp, which is not in the
+# repository. The tests never download the sheets.
+try:
+    import secret_farmapp
+except ImportError:
+    secret_farmapp = types.ModuleType('secret_farmapp')
+    secret_farmapp.GOOGLESHEETID = 'testsheet'
+    secret_farmapp.GOOGLESHEETDICT = {name: str(gid) for gid, name in enumerate(SHEETS)}
+    sys.modules['secret_farmapp'] = secret_farmapp
+
+import config_farmapp, db_pool, db_stuff, farmapp, http_cache # Internal
+
+@pytest.fixture(scope='session')
+def csv_dir(tmp_path_factory):
+    # The sheet tables of the bundled erdling.db, exported like the Google sheets.
+    csv_dir = tmp_path_factory.mktemp('csv')
+    with sqlite3.connect(os.path.join(ROOT, 'erdling.db')) as conn:
+        for name in SHEETS:
+            df = pd.read_sql(f'SELECT * FROM {name}', conn).convert_dtypes()
+            df.to_csv(csv_dir / f'{name}.csv', index=False)
+    return str(csv_dir)
+
+@pytest.fixture(scope='session')
+def ingested_db(tmp_path_factory, csv_dir):
+    # A database built by the ingest, with all derived tables and the search index.
+    database = str(tmp_path_factory.mktemp('ingest') / 'erdling.db')
+    db_stuff.init_db(database)
+    db_stuff.insert_data(csv_dir, SHEETS, database=database)
+    return database
+
+@pytest.fixture
+def use_database(monkeypatch, tmp_path):
+    # use_database(path) points the app and db_stuff to a copy of path.
+    def use(path):
+        database = str(tmp_path / 'erdling.db')
+        shutil.copyfile(path, database)
+        monkeypatch.setattr(farmapp, 'DATABASE', database)
+        monkeypatch.setattr(config_farmapp, 'DATABASE', database)
+        return database
+    monkeypatch.setattr(farmapp, 'FIGURE_CACHE_DIR', str(tmp_path / 'figure_cache'))
+    farmapp.get_anbau_figure_json.cache_clear()
+    farmapp.data_cache.clear()
+    http_cache.clear_cache()
+    yield use
+    db_pool.close_all()
+    farmapp.data_cache.clear()
+
+@pytest.fixture
+def database(use_database):
+    # A copy of the bundled erdling.db, which only holds the sheet tables.
+    return use_database(os.path.join(ROOT, 'erdling.db'))
+
+@pytest.fixture
+def client(database):
+    return farmapp.app.test_client()
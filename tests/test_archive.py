@@ -0,0 +1,94 @@
+import os # Standard
+import pandas as pd
+import pytest
+import archive, config_farmapp, db_stuff, farmapp # Internal
+from conftest import SHEETS
+from test_snapshot import assert_same_answer, query_results
+
+SEASONS = ['2022', '2023', '2024', '2025']
+# The Folien view only reads the live database, its closed seasons are archived.
+LIVE_ONLY = ['all_folien']
+
+def history_answers():
+    results = query_results()
+    for key in LIVE_ONLY:
+        del results[key]
+    return results
+
+def roll_over(database, seasons=SEASONS):
+    for year in seasons:
+        db_stuff.rollover_season(year, database=database)
+
+def test_rollover_moves_closed_seasons(use_database, ingested_db):
+    database = use_database(ingested_db)
+    roll_over(database)
+    assert archive.archive_paths(database) == [archive.archive_path(database, year) for year in reversed(SEASONS)]
+    with farmapp.db_pool.pooled_connection(database) as conn:
+        closed = conn.execute('''SELECT COUNT(*) FROM Plantings
+                    WHERE SUBSTR(StartDate, 1, 4) IN (?, ?, ?, ?) AND EndDate IS NOT NULL''', SEASONS).fetchone()[0]
+    assert closed == 0
+
+@pytest.mark.parametrize('max_attached', [archive.MAX_ATTACHED, 1])
+def test_history_is_the_same_after_the_rollover(use_database, ingested_db, monkeypatch, max_attached):
+    # With max_attached 1 every archive is its own batch, merged in Python.
+    monkeypatch.setattr(archive, 'MAX_ATTACHED', max_attached)
+    database = use_database(ingested_db)
+    expected = history_answers()
+    roll_over(database)
+    batches = farmapp.get_history_queries('SELECT * FROM {Plantings};')
+    assert len(batches) == (1 if max_attached > 1 else len(SEASONS))
+    actual = history_answers()
+    assert actual.keys() == expected.keys()
+    for key in expected:
+        assert_same_answer(key, actual[key], expected[key])
+
+def test_snapshot_reads_the_archives(use_database, ingested_db, monkeypatch):
+    database = use_database(ingested_db)
+    roll_over(database)
+    monkeypatch.setitem(farmapp.app.config, 'DATA_SNAPSHOT', False)
+    expected = query_results()
+    monkeypatch.setitem(farmapp.app.config, 'DATA_SNAPSHOT', True)
+    actual = query_results()
+    for key in expected:
+        assert_same_answer(key, actual[key], expected[key])
+
+def test_history_queries_follow_the_rollover(use_database, ingested_db):
+    database = use_database(ingested_db)
+    sql_query = 'SELECT PlantingID FROM {Plantings};'
+    assert farmapp.get_history_queries(sql_query) == [((), sql_query.format(Plantings='Plantings'))]
+    roll_over(database, ['2023'])
+    [(archives, batch_query)] = farmapp.get_history_queries(sql_query)
+    assert archives == (archive.archive_path(database, '2023'),)
+    assert 'archive_2023.Plantings' in batch_query
+
+def edit_sheet(csv_dir, tmp_path, sheetname, row_id, col, value):
+    # A copy of the sheet CSVs with one cell changed, the other rows as before.
+    edited_dir = tmp_path / 'csv'
+    edited_dir.mkdir()
+    for name in SHEETS:
+        df = pd.read_csv(os.path.join(csv_dir, f'{name}.csv'), dtype=str, keep_default_na=False)
+        if name == sheetname:
+            df.loc[df[df.columns[0]] == str(row_id), col] = value
+        df.to_csv(edited_dir / f'{name}.csv', index=False)
+    return str(edited_dir)
+
+def test_sync_reports_edits_to_archived_rows(use_database, ingested_db, csv_dir, tmp_path, capsys):
+    database = use_database(ingested_db)
+    assert config_farmapp.DATABASE == database
+    roll_over(database, ['2023'])
+    with farmapp.db_pool.pooled_connection(archive.archive_path(database, '2023')) as conn:
+        planting_id, notes = conn.execute('SELECT PlantingID, Notizen FROM Plantings ORDER BY PlantingID LIMIT 1').fetchone()
+    edited_dir = edit_sheet(csv_dir, tmp_path, 'Plantings', planting_id, 'Notizen', 'Im Archiv geändert')
+    capsys.readouterr()
+    for _sync in range(2):
+        # Listed again on every sync until the sheet matches the archive.
+        db_stuff.sync_data(edited_dir, SHEETS)
+        out = capsys.readouterr().out
+        assert 'archived rows were changed in the sheet' in out
+        assert f'[{planting_id}]' in out
+    with farmapp.db_pool.pooled_connection(database) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM Plantings WHERE PlantingID = ?', (planting_id,)).fetchone()[0] == 0
+    with farmapp.db_pool.pooled_connection(archive.archive_path(database, '2023')) as conn:
+        assert conn.execute('SELECT Notizen FROM Plantings WHERE PlantingID = ?', (planting_id,)).fetchone()[0] == notes
+    db_stuff.sync_data(csv_dir, SHEETS)
+    assert 'archived rows were changed' not in capsys.readouterr().out
@@ -0,0 +1,77 @@
+import os # Standard
+import pytest
+import crop_search, farmapp # Internal
+from conftest import ROOT
+
+@pytest.fixture(params=['ingested', 'baseline'])
+def search_database(request, use_database, ingested_db):
+    # With the search index, and the bundled database without it.
+    if request.param == 'ingested':
+        return use_database(ingested_db)
+    return use_database(os.path.join(ROOT, 'erdling.db'))
+
+def suggested_names(cols, history):
+    return [row[cols.index('CropName')] for row in history]
+
+def test_match_expression():
+    assert crop_search.match_expression('rote be') == '"rote"* "be"*'
+    assert crop_search.match_expression(' "OR" * ') == '"OR"*'
+    assert crop_search.match_expression('-') == ''
+    assert crop_search.alternative_names('Dicke Bohnen, Puffbohnen,') == ['Dicke Bohnen', 'Puffbohnen']
+
+@pytest.mark.parametrize('text, crop_name', [
+    ('Karotten', 'Karotten'), ('karotten', 'Karotten'), (' KAROTTEN ', 'Karotten'),
+    ('Möhren', 'Karotten'), ('porree', 'Lauch'),
+    ('spargel', 'Spargel'), ('Topinambur', 'Topinambur'),
+    ('Karot', None), ('Keine Kultur', None), ('"', None),
+])
+def test_resolve_crop_name(search_database, text, crop_name):
+    assert farmapp.resolve_crop_name(text) == crop_name
+
+def test_search_crops(search_database):
+    assert 'Karotten' in suggested_names(*farmapp.search_crops('Karot'))
+    # Never planted, but with Anbau infos.
+    assert farmapp.get_anbau_only_crops() == ['Spargel', 'Topinambur']
+    assert 'Spargel' in suggested_names(*farmapp.search_crops('Sparg'))
+    assert 'Karotten' in suggested_names(*farmapp.search_crops('karot'))
+    assert farmapp.search_crops('') == (crop_search.SEARCH_COLUMNS, [])
+    assert len(farmapp.search_crops('e', limit=3)[1]) <= 3
+
+def test_search_without_case_and_diacritics(use_database, ingested_db):
+    use_database(ingested_db)
+    assert suggested_names(*farmapp.search_crops('mohr'))[0] == 'Karotten'
+    assert suggested_names(*farmapp.search_crops('Porree'))[0] == 'Lauch'
+    # Only crops with a page: planted, or with Anbau infos.
+    crop_names = set(farmapp.get_all_planted_crops() + farmapp.get_anbau_only_crops())
+    assert set(suggested_names(*farmapp.search_crops('a', limit=1000))) <= crop_names
+
+def test_api_suggest(use_database, ingested_db):
+    use_database(ingested_db)
+    client = farmapp.app.test_client()
+    suggest = client.get('/api/suggest?q=Porree').get_json()
+    assert suggest['columns'] == crop_search.SEARCH_COLUMNS
+    assert suggest['values'][0][0] == 'Lauch'
+    assert client.get('/api/suggest').get_json()['values'] == [[], [], []]
+
+def test_landing_page_form(client):
+    response = client.post('/', data={'kulturname': 'Möhren'})
+    assert response.status_code == 302
+    assert response.location.endswith('/kulturname/Karotten')
+    assert client.post('/', data={'kulturname': 'spargel'}).location.endswith('/kulturname/Spargel')
+    not_found = client.post('/', data={'kulturname': 'Karot'})
+    assert not_found.status_code == 200
+    assert b'Keine Kultur "Karot" gefunden' in not_found.data
+    assert b'/kulturname/Karotten' in not_found.data
+    empty = client.post('/', data={'kulturname': '  '})
+    assert empty.status_code == 200
+    assert b'gefunden' not in empty.data
+
+def test_crop_pages(client):
+    response = client.get('/kulturname/Karotten')
+    assert response.status_code == 200
+    assert 'Kultur: Karotten'.encode() in response.data
+    anbau_only = client.get('/kulturname/Topinambur')
+    assert anbau_only.status_code == 200
+    assert 'Kultur: Topinambur'.encode() in anbau_only.data
+    missing = client.get('/kulturname/Keine Kultur')
+    assert missing.status_code == 404
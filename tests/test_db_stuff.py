@@ -0,0 +1,22 @@
+import db_stuff, farmapp # Internal
+from conftest import SHEETS
+from test_archive import edit_sheet
+
+def planting_notes(database, planting_id):
+    with farmapp.db_pool.pooled_connection(database) as conn:
+        return conn.execute('SELECT Notizen FROM Plantings WHERE PlantingID = ?', (planting_id,)).fetchone()[0]
+
+def test_ingest_and_sync_apply_edits(use_database, ingested_db, csv_dir, tmp_path, capsys):
+    # Ingest, edit the sheet, ingest again over the existing database, then sync.
+    database = use_database(ingested_db)
+    edited_dir = edit_sheet(csv_dir, tmp_path, 'Plantings', 5, 'Notizen', 'Nach dem Ingest geändert')
+    db_stuff.insert_data(edited_dir, SHEETS, database=database)
+    assert planting_notes(database, 5) == 'Nach dem Ingest geändert'
+    capsys.readouterr()
+    db_stuff.sync_data(edited_dir, SHEETS)
+    assert 'Sheet Plantings: 0 inserted, 0 updated, 0 deleted' in capsys.readouterr().out
+    assert planting_notes(database, 5) == 'Nach dem Ingest geändert'
+    # The stored hashes are the ones of the table, so the next edit is synced.
+    db_stuff.sync_data(csv_dir, SHEETS)
+    assert 'Sheet Plantings: 0 inserted, 1 updated, 0 deleted' in capsys.readouterr().out
+    assert planting_notes(database, 5) == planting_notes(ingested_db, 5)
@@ -0,0 +1,21 @@
+import os # Standard
+import export_static, farmapp # Internal
+
+def test_page_file():
+    assert export_static.page_file('site', '/beetID/5') == os.path.join('site', 'beetID', '5', 'index.html')
+    assert export_static.page_file('site', '/') == os.path.join('site', 'index.html')
+
+def test_export_site(database, tmp_path, monkeypatch):
+    # Every page of the app, crops with spaces and umlauts in the name included.
+    out_dir = str(tmp_path / 'site')
+    paths = export_static.export_paths()
+    assert export_static.export_site(out_dir, workers=1) == []
+    for path in paths:
+        assert os.path.getsize(export_static.page_file(out_dir, path)) > 0, path
+    assert os.path.exists(os.path.join(out_dir, 'static', farmapp.vendor_plotlyjs()))
+    # A second export replaces the first one.
+    monkeypatch.setattr(export_static, 'export_paths', lambda: ['/', '/folien'])
+    assert export_static.export_site(out_dir, workers=1) == []
+    assert os.path.exists(export_static.page_file(out_dir, '/'))
+    assert not os.path.exists(export_static.page_file(out_dir, '/ernteliste'))
+    assert not os.path.exists(f'{out_dir}.new') and not os.path.exists(f'{out_dir}.old')
@@ -0,0 +1,19 @@
+from datetime import datetime # Standard
+import pytest
+import farmapp, http_cache # Internal
+
+class LaterDatetime(datetime):
+    # The next day of a worker that was started on an earlier one.
+    @classmethod
+    def today(cls):
+        return cls(2031, 5, 6)
+
+@pytest.mark.parametrize('path', ['/beetID/5', '/kulturname/Karotten'])
+def test_figures_end_today(client, monkeypatch, path):
+    assert client.get(path).data
+    monkeypatch.setattr(farmapp, 'datetime', LaterDatetime)
+    monkeypatch.setattr(http_cache, 'datetime', LaterDatetime)
+    response = client.get(path)
+    assert response.status_code == 200
+    # The open plantings and the x axis end on the new day.
+    assert b'"range":["2024-01-01","2031-05-06"]' in response.data
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta # Standard
+import pandas as pd
+import pytest
+import farmapp, harvest # Internal
+
+LONGEST_DAY = harvest.daylength(172, harvest.LAT_SALZBURG)
+CROP_COLS = ['BedID', 'StartDate', 'EndDate', 'CropName', 'CropSorte', 'CropFamilie', 'PlantingMethod', 'Notizen']
+ANBAU_COLS = ['CropName', 'TagezurReifeGesäet', 'TagezurReifeGesetzt', 'TagezurReifeGesteckt']
+
+def days_ago(days):
+    return (datetime.today() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+def day_weight(day):
+    # One day of the original day by day loop.
+    day_of_year = day.timetuple().tm_yday
+    if day_of_year <= 70 or day_of_year >= 290:
+        return 0
+    return harvest.daylength(day_of_year, harvest.LAT_SALZBURG) / LONGEST_DAY
+
+def growing_days_by_loop(planting_date):
+    start = datetime.strptime(planting_date, '%Y-%m-%d')
+    days = abs((start - datetime.today()).days)
+    return round(sum(day_weight(start + timedelta(days=i)) for i in range(1, days)))
+
+@pytest.mark.parametrize('planting_date', [
+    days_ago(0), days_ago(1), days_ago(10), days_ago(100), days_ago(-30),
+    '2021-05-15', '2023-03-11', '2023-06-15', '2024-02-29', '2024-10-20',
+])
+def test_growing_days_match_the_day_by_day_loop(planting_date):
+    growing_days = harvest.growing_days_sunlight_curve(pd.Series([planting_date]))
+    assert int(growing_days[0]) == growing_days_by_loop(planting_date)
+    assert harvest.days_from_start_sunlight_curve(planting_date) == growing_days_by_loop(planting_date)
+
+def test_harvest_status():
+    crop_data = [
+        (1, days_ago(200), None, 'Salat', None, 'Asteraceae', 'gesetzt', None),
+        (2, days_ago(1), None, 'Salat', None, 'Asteraceae', 'gesät', None),
+        (3, days_ago(50), None, 'Kürbis', None, 'Cucurbitaceae', 'gesetzt', None),
+        (4, days_ago(200), days_ago(5), 'Salat', None, 'Asteraceae', 'gesetzt', None),
+    ]
+    anbau_data = [
+        ('Salat', 60, 40, None),
+        ('Kürbis', None, None, None),
+    ]
+    df_harvest = harvest.generate_harvest_table(CROP_COLS, crop_data, ANBAU_COLS, anbau_data)
+    assert list(df_harvest.columns) == harvest.HARVEST_COLUMNS
+    status = dict(zip(df_harvest['BedID'], df_harvest['ErnteStatus']))
+    # Closed plantings are not listed, the others in the order of the status.
+    assert status == {1: '1: Zum Ernten', 3: '2: Keine Ahnung', 2: '3: Reift noch'}
+    assert list(df_harvest['BedID']) == [1, 3, 2]
+    row = df_harvest.loc[df_harvest['BedID'] == 1].iloc[0]
+    assert row['TagezurReife'] == 40
+    assert row['TageNachStartSonne'] == growing_days_by_loop(days_ago(200))
+    assert row['TageNachReife'] == row['TageNachStartSonne'] - 40
+
+def test_stored_harvest_status_matches_the_live_table(use_database, ingested_db):
+    use_database(ingested_db)
+    assert farmapp.harvest_status_is_current()
+    stored = farmapp.query_harvest_status()
+    live = farmapp.generate_harvest_table()
+    pd.testing.assert_frame_equal(stored.reset_index(drop=True), live[harvest.HARVEST_COLUMNS].reset_index(drop=True), check_dtype=False)
+
+def ripeness_date_by_loop(planting_date, days_to_maturity):
+    # First day on which the day by day loop reaches the days to maturity.
+    day = datetime.strptime(planting_date, '%Y-%m-%d')
+    growing_days = 0
+    while round(growing_days) < days_to_maturity:
+        day += timedelta(days=1)
+        growing_days += day_weight(day)
+    return day.date()
+
+@pytest.mark.parametrize('planting_date, days_to_maturity', [
+    ('2024-05-01', 1), ('2024-05-01', 60), ('2024-07-15', 90), ('2024-09-20', 60),
+    ('2023-12-01', 30), ('2024-02-29', 45), ('2021-05-15', 250), (days_ago(20), 75),
+])
+def test_ripeness_dates_match_the_day_by_day_loop(planting_date, days_to_maturity):
+    dates = harvest.ripeness_dates(pd.Series([planting_date]), [days_to_maturity])
+    assert dates.astype(object)[0] == ripeness_date_by_loop(planting_date, days_to_maturity)
+
+def test_harvest_forecast():
+    crop_data = [
+        (1, '2024-05-01', None, 'Salat', None, 'Asteraceae', 'gesetzt', None),
+        (2, '2024-04-01', None, 'Salat', None, 'Asteraceae', 'gesät', None),
+        (3, '2024-05-01', None, 'Kürbis', None, 'Cucurbitaceae', 'gesetzt', None),
+    ]
+    anbau_data = [
+        ('Salat', 60, 40, None),
+        ('Kürbis', None, None, None),
+    ]
+    df_harvest = harvest.generate_harvest_table(CROP_COLS, crop_data, ANBAU_COLS, anbau_data)
+    df_forecast = harvest.generate_harvest_forecast(df_harvest)
+    assert list(df_forecast.columns) == harvest.FORECAST_COLUMNS
+    # Plantings without days to maturity have no date, the others are in date order.
+    expected = sorted([
+        (str(ripeness_date_by_loop('2024-05-01', 40)), 1),
+        (str(ripeness_date_by_loop('2024-04-01', 60)), 2),
+    ])
+    assert list(zip(df_forecast['Erntedatum'], df_forecast['BedID'])) == expected
+    for date, week in zip(df_forecast['Erntedatum'], df_forecast['Erntewoche']):
+        year, week_number, _day = datetime.strptime(date, '%Y-%m-%d').isocalendar()
+        assert week == f'{year}-KW{week_number:02d}'
+
+def test_erntekalender(client):
+    response = client.get('/erntekalender')
+    assert response.status_code == 200
+    assert b'Erntekalender' in response.data
+    forecast = client.get('/api/harvest/forecast').get_json()
+    assert forecast['columns'] == harvest.FORECAST_COLUMNS
+    df_forecast = pd.DataFrame(dict(zip(forecast['columns'], forecast['values'])))
+    assert df_forecast.shape[0] != 0
+    today = str(datetime.today().date())
+    df_harvest = farmapp.get_harvest_table()
+    for row in df_forecast.itertuples():
+        assert row.Erntedatum == str(ripeness_date_by_loop(row.StartDate, row.TagezurReife))
+        # Ripe by today exactly when the Ernteliste says so.
+        planting = df_harvest.loc[(df_harvest['BedID'] == row.BedID) & (df_harvest['StartDate'] == row.StartDate)
+            & (df_harvest['CropName'] == row.CropName)]
+        ripe = (planting['ErnteStatus'] == '1: Zum Ernten').unique().tolist()
+        assert ripe == [row.Erntedatum <= today]
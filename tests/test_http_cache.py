@@ -0,0 +1,63 @@
+import gzip, os # Standard
+import pytest
+import farmapp # Internal
+
+pytestmark = pytest.mark.skipif(not farmapp.app.config['HTTP_CACHE'], reason='FARMAPP_HTTP_CACHE=0')
+
+def fail_view(monkeypatch, endpoint):
+    # Make sure the answer comes from the cache, not from the view.
+    def view(*args, **kwargs):
+        raise AssertionError(f'{endpoint} should not run')
+    monkeypatch.setitem(farmapp.app.view_functions, endpoint, view)
+
+def test_validators(client):
+    response = client.get('/ernteliste')
+    assert response.status_code == 200
+    assert response.data
+    assert response.headers['ETag']
+    assert response.last_modified is not None
+    assert response.cache_control.no_cache
+    assert 'Accept-Encoding' in response.vary
+
+def test_not_modified_before_the_view_runs(client, monkeypatch):
+    response = client.get('/ernteliste')
+    assert response.data
+    fail_view(monkeypatch, 'ernteliste_table')
+    not_modified = client.get('/ernteliste', headers={'If-None-Match': response.headers['ETag']})
+    assert not_modified.status_code == 304
+    assert not_modified.data == b''
+    assert not_modified.headers['ETag'] == response.headers['ETag']
+    since = client.get('/ernteliste', headers={'If-Modified-Since': response.headers['Last-Modified']})
+    assert since.status_code == 304
+
+def test_new_etag_when_the_database_changes(client, database):
+    response = client.get('/ernteliste')
+    assert response.data
+    stat = os.stat(database)
+    os.utime(database, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    changed = client.get('/ernteliste', headers={'If-None-Match': response.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.data
+    assert changed.headers['ETag'] != response.headers['ETag']
+
+def test_gzip(client, monkeypatch):
+    identity = client.get('/ernteliste', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in identity.headers
+    compressed = client.get('/ernteliste', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['ETag'] != identity.headers['ETag']
+    assert len(compressed.data) < len(identity.data)
+    assert gzip.decompress(compressed.data) == identity.data
+    # The next browser gets the compressed page from the cache.
+    fail_view(monkeypatch, 'ernteliste_table')
+    cached = client.get('/ernteliste', headers={'Accept-Encoding': 'gzip'})
+    assert cached.status_code == 200
+    assert cached.headers['Content-Encoding'] == 'gzip'
+    assert cached.data == compressed.data
+
+def test_api_answers(client):
+    identity = client.get('/api/harvest', headers={'Accept-Encoding': 'identity'})
+    compressed = client.get('/api/harvest', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.status_code == 200
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == identity.data
@@ -0,0 +1,16 @@
+import os # Standard
+import farmapp, query_plan_check # Internal
+from conftest import ROOT
+
+def test_route_queries_use_indexes(use_database, ingested_db):
+    use_database(ingested_db)
+    assert query_plan_check.missing_tables() == []
+    assert query_plan_check.check_query_plans() == []
+
+def test_failed_queries_are_not_recorded(use_database):
+    # The bundled database has no Metadata table, the probe for it fails.
+    use_database(os.path.join(ROOT, 'erdling.db'))
+    assert query_plan_check.missing_tables() == query_plan_check.INGESTED_TABLES
+    recorded = query_plan_check.record_queries(farmapp.query_most_recent_update_date)
+    assert len(recorded) == 1
+    assert 'Metadata' not in recorded[0][0]
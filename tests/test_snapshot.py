@@ -0,0 +1,110 @@
+import math, os # Standard
+import pandas as pd
+import pytest
+import farmapp, snapshot # Internal
+from conftest import ROOT
+
+def normalized(value):
+    # pandas reads NULL in some columns as NaN, SQLite returns None.
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return [normalized(item) for item in value]
+    return value
+
+# The ORDER BY column of the queries. Rows with the same value may come in any order.
+ORDER_COLUMNS = {
+    'all_unharvested_crops': 'StartDate',
+    'all_folien': 'StartDate',
+    'planting_history_per_bed': 'StartDate',
+    'soil_history': 'StartDate',
+    'planting_history_per_family': 'BedID',
+    'specific_crop': 'StartDate',
+}
+
+def assert_same_answer(key, actual, expected):
+    name = key[0] if isinstance(key, tuple) else key
+    if name not in ORDER_COLUMNS:
+        assert actual == expected, key
+        return
+    (cols, rows), (expected_cols, expected_rows) = actual, expected
+    assert cols == expected_cols, key
+    i = cols.index(ORDER_COLUMNS[name])
+    assert [row[i] for row in rows] == [row[i] for row in expected_rows], key
+    assert sorted(map(repr, rows)) == sorted(map(repr, expected_rows)), key
+
+def bed_sets(family_years):
+    # The order of GROUP_CONCAT is undefined, the overview sorts the beds.
+    cols, rows = family_years
+    return cols, [(family, yyyy, set(bed_str.split(',')), bed_count) for family, yyyy, bed_str, bed_count in rows]
+
+def query_results():
+    beds = farmapp.get_all_active_beds() + [1, '5', '5.0', 9999, 'abc']
+    crops = [name for name in farmapp.get_all_planted_crops() if name is not None]
+    crops += [name.upper() for name in crops[:10]] + ['Keine Kultur']
+    families = list(farmapp.crop_family_colors) + ['Keine Familie']
+    results = {
+        'beds_per_family_and_year': bed_sets(farmapp.get_beds_per_family_and_year(families)),
+        'all_anbau_info': farmapp.get_all_anbau_info(),
+        'all_unharvested_crops': farmapp.get_all_unharvested_crops(),
+        'all_planted_crops': farmapp.get_all_planted_crops(),
+        'all_active_beds': farmapp.get_all_active_beds(),
+        'all_folien': farmapp.get_all_folien(),
+        'most_recent_update_date': farmapp.query_most_recent_update_date(),
+    }
+    for bid in beds:
+        results[('planting_history_per_bed', bid)] = farmapp.get_planting_history_per_bed(bid)
+        results[('soil_history', bid)] = farmapp.get_soil_history(bid)
+    for family in families:
+        results[('planting_history_per_family', family)] = farmapp.get_planting_history_per_family(family)
+    for crop in crops:
+        results[('anbau_info', crop)] = farmapp.get_anbau_info(crop)
+        results[('specific_crop', crop)] = farmapp.get_specific_crop(crop)
+    return {key: normalized(value) for key, value in results.items()}
+
+@pytest.mark.parametrize('source', ['baseline', 'ingested'])
+def test_snapshot_answers_like_sql(use_database, ingested_db, monkeypatch, source):
+    use_database(os.path.join(ROOT, 'erdling.db') if source == 'baseline' else ingested_db)
+    monkeypatch.setitem(farmapp.app.config, 'DATA_SNAPSHOT', False)
+    expected = query_results()
+    monkeypatch.setitem(farmapp.app.config, 'DATA_SNAPSHOT', True)
+    assert farmapp.data_snapshot() is not None
+    actual = query_results()
+    assert actual.keys() == expected.keys()
+    for key in expected:
+        assert_same_answer(key, actual[key], expected[key])
+
+def test_stored_harvest_status(use_database, ingested_db, monkeypatch):
+    use_database(ingested_db)
+    monkeypatch.setitem(farmapp.app.config, 'DATA_SNAPSHOT', False)
+    expected = farmapp.query_harvest_status()
+    monkeypatch.setitem(farmapp.app.config, 'DATA_SNAPSHOT', True)
+    pd.testing.assert_frame_equal(farmapp.query_harvest_status(), expected)
+
+def test_typed_columns(database):
+    snap = snapshot.load_snapshot(database, farmapp.get_data_version())
+    for col in snapshot.DATE_COLUMNS:
+        assert isinstance(snap['plantings'][col].categories, pd.DatetimeIndex), col
+    assert isinstance(snap['soil']['StartDate'].categories, pd.DatetimeIndex)
+    # Back as the ISO strings SQLite returns.
+    labels = snap['values']['plantings']['StartDate'][1]
+    assert all(label is None or len(label) == 10 for label in labels)
+
+def test_new_snapshot_for_a_new_data_version(database, monkeypatch):
+    monkeypatch.setitem(farmapp.app.config, 'DATA_SNAPSHOT', True)
+    snap = farmapp.data_snapshot()
+    assert farmapp.data_snapshot() is snap
+    stat = os.stat(database)
+    os.utime(database, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert farmapp.data_snapshot() is not snap
+
+def test_snapshot_query_dispatch(monkeypatch):
+    calls = []
+    @farmapp.snapshot_query(lambda snap, bid: ('snapshot', snap, bid))
+    def query(bid):
+        return ('sql', bid)
+    monkeypatch.setattr(farmapp, 'data_snapshot', lambda: None)
+    assert query(5) == ('sql', 5)
+    monkeypatch.setattr(farmapp, 'data_snapshot', lambda: calls)
+    assert query(5) == ('snapshot', calls, 5)
+    assert query.__name__ == 'query'